@@ -0,0 +1,43 @@
+"""Benchmark the serialization of a deep realized account tree.
+
+Compares `serialize_real_account` with the previous serializer, which
+computes the balance of every subtree with `realization.compute_balance` and
+is therefore quadratic in the depth of the tree.  Both the ledger and the
+previous serializer are taken from the tests.
+
+Usage: python contrib/benchmarks/serialize_real_account.py [DEPTH]
+"""
+
+import os
+import sys
+import timeit
+
+from beancount.core import realization
+from beancount.loader import load_string
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from fava.api.serialization import serialize_real_account  # noqa: E402
+from tests.test_api_serialization import (  # noqa: E402
+    baseline_serialize_real_account, deep_ledger)
+
+
+def main():
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    entries, _, _ = load_string(deep_ledger(depth))
+    real_account = realization.realize(entries)
+    assert serialize_real_account(real_account) == \
+        baseline_serialize_real_account(real_account)
+
+    print('depth {}, {} accounts'.format(
+        depth, len(list(realization.iter_children(real_account)))))
+    for function in [serialize_real_account,
+                     baseline_serialize_real_account]:
+        number = 3
+        seconds = timeit.timeit(lambda: function(real_account), number=number)
+        print('{:32} {:8.1f} ms'.format(function.__name__,
+                                        seconds / number * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,16 +2,20 @@
 This module provides the data required by Fava's reports.
 """
 
+import bisect
+import collections
+import copy
+import logging
 import operator
 import os
+import threading
+import time
 
-from beancount.core.number import Decimal
+from beancount.core.number import ZERO
 
-from beancount import loader
-from beancount.core import compare, flags, getters, realization, inventory
-from beancount.core.interpolate import compute_entries_balance
-from beancount.core.account_types import get_account_sign
-from beancount.core.data import (get_entry, iter_entry_dates, Open, Close,
+from beancount.core import compare, flags, getters, realization
+from beancount.core.account_types import get_account_sign, get_account_type
+from beancount.core.data import (get_entry, Open, Close,
                                  Document, Balance, TxnPosting, Transaction,
                                  Event, Query, Custom)
 from beancount.ops import prices, holdings, summarize
@@ -20,17 +24,31 @@ from beancount.query import query
 from beancount.reports import context
 from beancount.utils import encryption, misc_utils
 
-from fava.util import date
-from fava.api.budgets import parse_budgets, calculate_budget
-from fava.api.watcher import Watcher
-from fava.api.filters import (AccountFilter, FromFilter, PayeeFilter,
-                              TagFilter, TimeFilter)
-from fava.api.helpers import holdings_at_dates
-from fava.api.serialization import (serialize_inventory,
-                                    serialize_real_account, zip_real_accounts)
+from fava.util import cached_property, date
+from fava.api.budgets import budget_matrix, parse_budgets
+from fava.api.watcher import get_watcher
+from fava.api.filters import (AccountFilter, EntryIndex, FromFilter,
+                              PayeeFilter, TagFilter, TimeFilter)
+from fava.api.helpers import (BalanceCheckpoints, cumulative_changes,
+                              get_holding_from_position, interval_balances)
+from fava.api.loading import (IncrementalLoader, load_cache, remove_cache,
+                              write_cache)
+from fava.api.serialization import serialize_inventory, serialize_real_account
 from fava.api.fava_options import parse_options
 
 
+# The filters in the order they are applied.  The filters that can use the
+# EntryIndex come first.  The time filter changes most often, so it comes
+# last (see `BeancountReportAPI._filter_entries`).
+FILTERS = [
+    ('account', AccountFilter),
+    ('payee', PayeeFilter),
+    ('tag', TagFilter),
+    ('from', FromFilter),
+    ('time', TimeFilter),
+]
+
+
 class FavaAPIException(Exception):
     pass
 
@@ -49,8 +67,18 @@ def _list_accounts(root_account, active_only=False):
     return accounts if active_only else accounts[1:]
 
 
+def _entries_in_period(entries, dates, begin_date, end_date):
+    """The entries with begin_date <= entry.date < end_date.
+
+    The entries are sorted by date and `dates` contains their dates, so the
+    period can be found with a binary search.
+    """
+    return entries[bisect.bisect_left(dates, begin_date):
+                   bisect.bisect_left(dates, end_date)]
+
+
 def _real_account(account_name, entries, begin_date=None, end_date=None,
-                  min_accounts=None):
+                  min_accounts=None, dates=None):
     """
     Returns the realization.RealAccount instances for account_name, and
     their entries clamped by the optional begin_date and end_date.
@@ -61,7 +89,9 @@ def _real_account(account_name, entries, begin_date=None, end_date=None,
     :return: realization.RealAccount instances
     """
     if begin_date:
-        entries = list(iter_entry_dates(entries, begin_date, end_date))
+        if dates is None:
+            dates = [entry.date for entry in entries]
+        entries = _entries_in_period(entries, dates, begin_date, end_date)
     if not min_accounts:
         min_accounts = [account_name]
 
@@ -83,40 +113,29 @@ def _sidebar_links(custom_entries):
             for entry in sidebar_link_entries]
 
 
-class BeancountReportAPI():
-    """Provides methods to access and filter beancount entries.
-    """
+def _budget_deltas(budget, balance):
+    """The differences between a budget and a balance (both currency ->
+    number dicts) for the currencies of the budget."""
+    return {currency: number - balance.get(currency, ZERO)
+            for currency, number in budget.items()}
 
-    def __init__(self, beancount_file_path):
-        self.beancount_file_path = beancount_file_path
-        self.is_encrypted = encryption.is_encrypted_file(beancount_file_path)
-        self.filters = {
-            'account': AccountFilter(),
-            'from': FromFilter(),
-            'payee': PayeeFilter(),
-            'tag': TagFilter(),
-            'time': TimeFilter(),
-        }
 
-        self.watcher = Watcher()
-        self.load_file()
+class Ledger(object):
+    """A loaded Beancount file.
+
+    Contains the entries, errors and options of the file and everything
+    computed from them that is independent of how the entries might be
+    filtered.  A Ledger is never modified after it has been created, so a
+    reload can build a new one and swap it in.
+
+    Most of the derived data is only computed when it is first accessed.
+    """
+
+    def __init__(self, entries, errors, options_map):
+        self.all_entries = entries
+        self.errors = list(errors)
+        self.options = options_map
 
-    def load_file(self):
-        """Load self.beancount_file_path and compute things that are independent
-        of how the entries might be filtered later"""
-        # use the internal function to disable cache
-        if not self.is_encrypted:
-            self.all_entries, self.errors, self.options = \
-                loader._load([(self.beancount_file_path, True)],
-                             None, None, None)
-            include_path = os.path.dirname(self.beancount_file_path)
-            self.watcher.update(self.options['include'], [
-                os.path.join(include_path, path)
-                for path in self.options['documents']])
-        else:
-            self.all_entries, self.errors, self.options = \
-                loader.load_file(self.beancount_file_path)
-        self.price_map = prices.build_price_map(self.all_entries)
         self.account_types = options.get_account_types(self.options)
 
         self.title = self.options['title']
@@ -127,37 +146,99 @@ class BeancountReportAPI():
             self.format_string = '{:f}'
             self.default_format_string = '{:.2f}'
 
-        self.active_years = list(getters.get_active_years(self.all_entries))
-        self.active_tags = list(getters.get_all_tags(self.all_entries))
-        self.active_payees = list(getters.get_all_payees(self.all_entries))
-
-        self.queries = _filter_entries_by_type(self.all_entries, Query)
+        # These are needed for every request and are cheap to compute.
         self.custom_entries = _filter_entries_by_type(self.all_entries, Custom)
 
-        self.all_root_account = realization.realize(self.all_entries,
-                                                    self.account_types)
-        self.all_accounts = _list_accounts(self.all_root_account)
-        self.all_accounts_active = _list_accounts(
-            self.all_root_account, active_only=True)
-
-        self.sidebar_links = _sidebar_links(self.custom_entries)
-
         self.fava_options, errors = parse_options(self.custom_entries)
         self.errors.extend(errors)
 
         self.budgets, errors = parse_budgets(self.custom_entries)
         self.errors.extend(errors)
 
-        self._apply_filters()
+    def __getstate__(self):
+        # The entry hashes are keyed by the ids of the entries, which are
+        # different after unpickling.
+        state = self.__dict__.copy()
+        state.pop('entry_hashes', None)
+        return state
+
+    @cached_property
+    def price_map(self):
+        return prices.build_price_map(self.all_entries)
+
+    @cached_property
+    def active_years(self):
+        return list(getters.get_active_years(self.all_entries))
+
+    @cached_property
+    def active_tags(self):
+        return list(getters.get_all_tags(self.all_entries))
+
+    @cached_property
+    def active_payees(self):
+        return list(getters.get_all_payees(self.all_entries))
+
+    @cached_property
+    def queries(self):
+        return _filter_entries_by_type(self.all_entries, Query)
+
+    @cached_property
+    def all_root_account(self):
+        return realization.realize(self.all_entries, self.account_types)
+
+    @cached_property
+    def all_accounts(self):
+        return _list_accounts(self.all_root_account)
+
+    @cached_property
+    def all_accounts_active(self):
+        return _list_accounts(self.all_root_account, active_only=True)
+
+    @cached_property
+    def sidebar_links(self):
+        return _sidebar_links(self.custom_entries)
 
-    def _apply_filters(self):
-        self.entries = self.all_entries
+    @cached_property
+    def entry_index(self):
+        return EntryIndex(self.all_entries)
 
-        for filter_class in self.filters.values():
-            self.entries = filter_class.apply(self.entries, self.options)
+    @cached_property
+    def entry_hashes(self):
+        """The hashes of all entries, by the id of the entry.
+
+        The entries are kept alive by the ledger, so their ids are unique.
+        """
+        return {id(entry): compare.hash_entry(entry)
+                for entry in self.all_entries}
+
+    @cached_property
+    def entries_by_hash(self):
+        """Lists of the entries with a given hash."""
+        entries_by_hash = collections.defaultdict(list)
+        entry_hashes = self.entry_hashes
+        for entry in self.all_entries:
+            entries_by_hash[entry_hashes[id(entry)]].append(entry)
+        return dict(entries_by_hash)
+
+
+class FilteredLedger(object):
+    """A filtered view of a :class:`Ledger`.
+
+    Provides the data for Fava's reports.  Like the Ledger, a FilteredLedger
+    is not modified after it has been created, so every request can use its
+    own view without interfering with other (concurrent) requests.  The
+    attributes of the ledger can be accessed directly on the view.
+    """
+
+    def __init__(self, beancount_file_path, ledger, filters, entries):
+        self.beancount_file_path = beancount_file_path
+        self.ledger = ledger
+        self.filters = filters
+        self.entries = entries
+        self._cumulative_changes_cache = {}
 
         self.root_account = realization.realize(self.entries,
-                                                self.account_types)
+                                                ledger.account_types)
 
         self.date_first, self.date_last = \
             getters.get_min_max_dates(self.entries, (Transaction))
@@ -166,28 +247,26 @@ class BeancountReportAPI():
             self.date_first = self.filters['time'].begin_date
             self.date_last = self.filters['time'].end_date
 
-    def filter(self, **kwargs):
-        """Set and apply (if necessary) filters."""
-        changed = False
-        for filter_name, filter_class in self.filters.items():
-            if filter_class.set(kwargs[filter_name]):
-                changed = True
+    def __getattr__(self, name):
+        if name == 'ledger':
+            raise AttributeError(name)
+        return getattr(self.ledger, name)
 
-        if changed:
-            self._apply_filters()
+    @cached_property
+    def entry_dates(self):
+        """The dates of the filtered entries, to find periods by bisection."""
+        return [entry.date for entry in self.entries]
 
     def hash_entry(self, entry):
-        return compare.hash_entry(entry)
+        """The hash of the entry, looked up for the entries of the ledger.
 
-    def changed(self):
-        """Check if the file needs to be reloaded. """
-        # We can't reload an encrypted file, so act like it never changes.
-        if self.is_encrypted:
-            return False
-        changed = self.watcher.check()
-        if changed:
-            self.load_file()
-        return changed
+        Entries that the filters created (like summarizing opening balances)
+        are hashed on each call.
+        """
+        ehash = self.entry_hashes.get(id(entry))
+        if ehash is None:
+            ehash = compare.hash_entry(entry)
+        return ehash
 
     def quantize(self, value, currency):
         """Quantize the value to the right number of decimal digits.
@@ -203,12 +282,33 @@ class BeancountReportAPI():
         period in which entries contains transactions.  """
         return date.interval_tuples(self.date_first, self.date_last, interval)
 
+    def _cumulative_changes(self, account_name):
+        """The running totals of the account, see `cumulative_changes`."""
+        changes = self._cumulative_changes_cache.get(account_name)
+        if changes is None:
+            changes = cumulative_changes(self.entries, account_name)
+            self._cumulative_changes_cache[account_name] = changes
+        return changes
+
     def _total_balance(self, names, begin_date, end_date):
-        totals = [realization.compute_balance(
-            _real_account(account_name, self.entries, begin_date, end_date))
-                  for account_name in names]
-        return serialize_inventory(sum(totals, inventory.Inventory()),
-                                   at_cost=True)
+        """The total (at cost) of the accounts in the given period.
+
+        This is the difference of the running totals at the end and at the
+        beginning of the period.
+        """
+        totals = {}
+        for account_name in names:
+            dates, cumulative = self._cumulative_changes(account_name)
+            index = bisect.bisect_left(dates, end_date)
+            if index:
+                for currency, number in cumulative[index - 1].items():
+                    totals[currency] = totals.get(currency, ZERO) + number
+            index = bisect.bisect_left(dates, begin_date)
+            if index:
+                for currency, number in cumulative[index - 1].items():
+                    totals[currency] = totals.get(currency, ZERO) - number
+        return {currency: number for currency, number in totals.items()
+                if number}
 
     def interval_totals(self, interval, account_name):
         """Renders totals for account (or accounts) in the intervals."""
@@ -230,7 +330,8 @@ class BeancountReportAPI():
 
     def balances(self, account_name, begin_date=None, end_date=None):
         real_account = _real_account(
-            account_name, self.entries, begin_date, end_date)
+            account_name, self.entries, begin_date, end_date,
+            dates=self.entry_dates)
         return [serialize_real_account(real_account)]
 
     def closing_balances(self, account_name):
@@ -245,15 +346,12 @@ class BeancountReportAPI():
                          if account.startswith(account_name)]
 
         interval_tuples = self._interval_tuples(interval)
-        interval_balances = [
-            _real_account(
-                account_name, self.entries,
-                interval_tuples[0][0] if accumulate else begin_date,
-                end_date, min_accounts=account_names)
-            for begin_date, end_date in interval_tuples]
+        balances = interval_balances(
+            self.entries, self.entry_dates, account_name, account_names,
+            interval_tuples, accumulate)
 
-        return self.add_budgets(zip_real_accounts(interval_balances),
-                                interval_tuples, accumulate), interval_tuples
+        return self.add_budgets(balances, interval_tuples,
+                                accumulate), interval_tuples
 
     def add_budgets(self, zipped_interval_balances, interval_tuples,
                     accumulate):
@@ -261,36 +359,38 @@ class BeancountReportAPI():
         if not zipped_interval_balances:
             return
 
-        interval_budgets = [
-            calculate_budget(
-                self.budgets,
-                zipped_interval_balances['account'],
-                interval_tuples[0][0] if accumulate else begin_date,
-                end_date
-            ) for begin_date, end_date in interval_tuples]
-
-        zipped_interval_balances['balance_and_balance_children'] = [(
-            balances[0],
-            balances[1],
-            {curr: value - (balances[0][curr] if curr in balances[0] else Decimal(0.0)) for curr, value in budget.items()},  # noqa
-            {curr: value - (balances[1][curr] if curr in balances[1] else Decimal(0.0)) for curr, value in budget.items()})  # noqa
-            for balances, budget in zip(zipped_interval_balances['balance_and_balance_children'], interval_budgets)  # noqa
-        ]
-
-        zipped_interval_balances['children'] = [self.add_budgets(
-            child, interval_tuples, accumulate)
-            for child in zipped_interval_balances['children']]
-
+        account_names = []
+        stack = [zipped_interval_balances]
+        while stack:
+            node = stack.pop()
+            account_names.append(node['account'])
+            stack.extend(node['children'])
+        matrix = budget_matrix(self.budgets, account_names, interval_tuples,
+                               accumulate)
+
+        def _add_budgets(node):
+            node['balance_and_balance_children'] = [
+                (balance, balance_children,
+                 _budget_deltas(budget, balance),
+                 _budget_deltas(budget, balance_children))
+                for (balance, balance_children), budget in zip(
+                    node['balance_and_balance_children'],
+                    matrix[node['account']])]
+            for child in node['children']:
+                _add_budgets(child)
+
+        _add_budgets(zipped_interval_balances)
         return zipped_interval_balances
 
     def trial_balance(self):
         return serialize_real_account(self.root_account)['children']
 
     def account_journal(self, account_name, with_journal_children=False):
-        real_account = realization.get_or_create(self.root_account,
-                                                 account_name)
+        real_account = realization.get(self.root_account, account_name)
 
-        if with_journal_children:
+        if real_account is None:
+            postings = []
+        elif with_journal_children:
             postings = realization.get_postings(real_account)
         else:
             postings = real_account.txn_postings
@@ -348,22 +448,51 @@ class BeancountReportAPI():
         return totals
 
     def net_worth_at_intervals(self, interval):
+        """The net worth at the boundaries of the intervals.
+
+        The balances of the asset and liability accounts at these dates are
+        computed from the balance checkpoints.  Like in `holdings_at_dates`,
+        unrealized gains are not included.
+        """
         interval_tuples = self._interval_tuples(interval)
         if interval_tuples:
             dates = [interval_tuples[0][0]] + [p[1] for p in interval_tuples]
         else:
             dates = []
 
-        return [{
-            'date': date,
-            'balance': self._holdings_to_net_worth(holdings_list),
-        } for date, holdings_list in
-            zip(dates, holdings_at_dates(self.entries, dates,
-                                         self.price_map, self.options))]
+        types = (self.account_types.assets, self.account_types.liabilities)
+        is_holding = set(
+            name for name in self.balance_checkpoints.final
+            if get_account_type(name) in types).__contains__
+
+        unrealized = [entry for entry in self.entries
+                      if isinstance(entry, Transaction) and
+                      entry.flag == flags.FLAG_UNREALIZED]
+
+        net_worth = []
+        for at_date, inventory in zip(
+                dates, self.balance_checkpoints.balances_at_dates(
+                    dates, is_holding)):
+            if unrealized and unrealized[0].date < at_date:
+                inventory = copy.copy(inventory)
+                for entry in unrealized:
+                    if entry.date >= at_date:
+                        break
+                    for posting in entry.postings:
+                        if is_holding(posting.account):
+                            inventory.add_amount(-posting.units,
+                                                 posting.cost)
+            net_worth.append({
+                'date': at_date,
+                'balance': self._holdings_to_net_worth([
+                    get_holding_from_position(position, self.price_map,
+                                              at_date)
+                    for position in inventory]),
+            })
+        return net_worth
 
     def context(self, ehash):
-        matching_entries = [entry for entry in self.all_entries
-                            if ehash == compare.hash_entry(entry)]
+        matching_entries = self.entries_by_hash.get(ehash, [])
 
         if not matching_entries:
             return
@@ -411,14 +540,6 @@ class BeancountReportAPI():
             source = file.read()
         return source
 
-    def set_source(self, file_path, source):
-        if file_path not in self.source_files():
-            raise FavaAPIException('Trying to write a non-source file')
-
-        with open(file_path, 'w+', encoding='utf8') as file:
-            file.write(source)
-        self.load_file()
-
     def commodity_pairs(self):
         fw_pairs = self.price_map.forward_pairs
         bw_pairs = []
@@ -442,8 +563,9 @@ class BeancountReportAPI():
     def last_entry(self, account_name):
         """The last entry of the account if it is not a Close entry.
         """
-        account = realization.get_or_create(self.all_root_account,
-                                            account_name)
+        account = realization.get(self.all_root_account, account_name)
+        if account is None:
+            return
 
         last = realization.find_last_active_posting(account.txn_postings)
 
@@ -452,8 +574,30 @@ class BeancountReportAPI():
 
         return get_entry(last)
 
-    def inventory(self, account_name):
-        return compute_entries_balance(self.entries, prefix=account_name)
+    @cached_property
+    def balance_checkpoints(self):
+        """The monthly balances of all accounts, see `BalanceCheckpoints`."""
+        checkpoints = BalanceCheckpoints(self.entries, self.entry_dates)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(
+                'Balance checkpoints for %s: %d checkpoints, %d bytes',
+                self.beancount_file_path, len(checkpoints.checkpoint_dates),
+                checkpoints.memory_usage())
+        return checkpoints
+
+    def inventory(self, account_name, date=None):
+        """The balance of all accounts starting with account_name.
+
+        This is the same inventory as
+        `beancount.core.interpolate.compute_entries_balance`, though the order
+        of the positions can differ if multiple accounts match.
+
+        Args:
+            account_name: The prefix of the account names.
+            date: If given, only postings before this date are included.
+        """
+        return self.balance_checkpoints.balance(
+            lambda name: name.startswith(account_name), date)
 
     def postings_by_account(self):
         all_postings = [posting
@@ -488,8 +632,9 @@ class BeancountReportAPI():
                                query_string, numberify=numberify)
 
     def _last_balance_or_transaction(self, account_name):
-        real_account = realization.get_or_create(self.all_root_account,
-                                                 account_name)
+        real_account = realization.get(self.all_root_account, account_name)
+        if real_account is None:
+            return
 
         for txn_posting in reversed(real_account.txn_postings):
             if not isinstance(txn_posting, (TxnPosting, Balance)):
@@ -523,9 +668,330 @@ class BeancountReportAPI():
 
         This is read from the Open entry of the account.
         """
-        real_account = realization.get_or_create(self.root_account,
-                                                 account_name)
+        real_account = realization.get(self.root_account, account_name)
+        if real_account is None:
+            return {}
         for posting in real_account.txn_postings:
             if isinstance(posting, Open):
                 return posting.meta
         return {}
+
+
+def load_ledger(incremental_loader, use_cache=False):
+    """Load the file of the given IncrementalLoader.
+
+    Only files that changed since the last load of the loader are parsed
+    again.  If caching is enabled with use_cache and the loader has not
+    loaded anything yet, the on-disk cache is tried first.  The cache is
+    written if caching is enabled with use_cache or the `parse-cache` Fava
+    option.  Encrypted files are never cached on disk, see
+    `IncrementalLoader.load_encrypted`.
+
+    Returns:
+        The loaded Ledger.
+    """
+    beancount_file_path = incremental_loader.beancount_file_path
+    if encryption.is_encrypted_file(beancount_file_path):
+        return Ledger(*incremental_loader.load_encrypted())
+
+    result = None
+    # Unpickling the cache can execute arbitrary code, so it is only read if
+    # caching has been explicitly enabled before loading.
+    if use_cache and not incremental_loader.parse_count:
+        result = load_cache(beancount_file_path)
+    cache_hit = result is not None
+    if not cache_hit:
+        result = incremental_loader.load()
+    ledger = Ledger(*result)
+
+    if not cache_hit:
+        if use_cache or ledger.fava_options['parse-cache']:
+            write_cache(beancount_file_path, result)
+        else:
+            remove_cache(beancount_file_path)
+    return ledger
+
+
+def preload(beancount_file_path, use_cache=False):
+    """Load a Beancount file, e.g., in another process.
+
+    Returns:
+        A triple of the IncrementalLoader, the Ledger and the time the load
+        took, which can be passed to BeancountReportAPI as `preloaded`.
+    """
+    start = time.time()
+    incremental_loader = IncrementalLoader(beancount_file_path)
+    ledger = load_ledger(incremental_loader, use_cache)
+    return incremental_loader, ledger, time.time() - start
+
+
+class BeancountReportAPI():
+    """Loads a Beancount file and provides filtered views of it.
+
+    The attributes of the current :class:`Ledger` (like ``all_entries`` or
+    ``options``) can be accessed directly on this class, the data for the
+    reports is provided by the :class:`FilteredLedger` returned by `filter`.
+
+    The views for the most recently used filter combinations are kept
+    around, so switching back and forth between filters does not require
+    filtering the entries again.
+    """
+
+    #: Number of filtered views that are kept for the current ledger.
+    FILTER_CACHE_SIZE = 16
+
+    def __init__(self, beancount_file_path, use_cache=False, preloaded=None):
+        self.beancount_file_path = beancount_file_path
+        self.use_cache = use_cache
+        self.is_encrypted = encryption.is_encrypted_file(beancount_file_path)
+
+        self.loader = IncrementalLoader(beancount_file_path)
+        self.watcher = get_watcher()
+        self.ledger = None
+        self._load_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._reload_thread = None
+        self._reload_requested = False
+        self._last_change = 0
+        self._reloaded_ledger = None
+        self._reloaded = False
+        self._filter_lock = threading.Lock()
+        self._filtered = collections.OrderedDict()
+        self._filter_stages = collections.OrderedDict()
+        self._filtered_ledger = None
+        self.filter_cache_hits = 0
+        self.filter_cache_misses = 0
+        self.load_duration = None
+        if preloaded:
+            self.loader, self.ledger, self.load_duration = preloaded
+            self._watch(self.ledger)
+        else:
+            self.load_file()
+
+    def __getattr__(self, name):
+        if name == 'ledger':
+            raise AttributeError(name)
+        return getattr(self.ledger, name)
+
+    def _watch(self, ledger):
+        """Watch the files and document folders of the given ledger."""
+        files = ledger.options['include']
+        if self.is_encrypted:
+            files = [self.beancount_file_path] + files
+        include_path = os.path.dirname(self.beancount_file_path)
+        self.watcher.update(files, [
+            os.path.join(include_path, path)
+            for path in ledger.options['documents']])
+
+    def _load(self):
+        """Load self.beancount_file_path and return the new Ledger.
+
+        Has to be called with self._load_lock held.
+        """
+        # The changes up to now are part of this load, only the ones that
+        # happen while loading should trigger another reload.
+        self.watcher.check()
+        start = time.time()
+        ledger = load_ledger(self.loader, self.use_cache)
+        self.load_duration = time.time() - start
+        return ledger
+
+    def load_file(self):
+        """Load self.beancount_file_path and compute things that are independent
+        of how the entries might be filtered later"""
+        with self._load_lock:
+            self.ledger = self._load()
+            self._watch(self.ledger)
+            with self._reload_lock:
+                self._reloaded_ledger = None
+
+    def _wait_for_quiet_period(self):
+        """Wait until the files have not changed for a while.
+
+        Editors and tools like git often write several files in a short
+        time, this way they only cause a single reload.
+        """
+        quiet_period = self.fava_options['reload-quiet-period'] / 1000
+        while True:
+            if self.watcher.check():
+                self._last_change = time.time()
+            remaining = self._last_change + quiet_period - time.time()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def _reload_worker(self):
+        """Reload the file until no more reloads have been requested.
+
+        If the reload fails, the error is logged and the thread is reset, so
+        that the next change starts a new reload.
+        """
+        try:
+            while True:
+                with self._reload_lock:
+                    if not self._reload_requested:
+                        self._reload_thread = None
+                        return
+                self._wait_for_quiet_period()
+                with self._reload_lock:
+                    self._reload_requested = False
+                with self._load_lock:
+                    ledger = self._load()
+                    self._watch(ledger)
+                    with self._reload_lock:
+                        self._reloaded_ledger = ledger
+        except Exception:  # pylint: disable=broad-except
+            logging.exception('Failed to reload %s', self.beancount_file_path)
+        finally:
+            with self._reload_lock:
+                if self._reload_thread is threading.current_thread():
+                    self._reload_thread = None
+                    self._reload_requested = False
+
+    def _reload(self):
+        """Reload the file in a background thread."""
+        with self._reload_lock:
+            self._reload_requested = True
+            self._last_change = time.time()
+            if self._reload_thread is None:
+                self._reload_thread = threading.Thread(
+                    target=self._reload_worker, daemon=True)
+                self._reload_thread.start()
+
+    @property
+    def reload_pending(self):
+        """Whether the file is currently being reloaded."""
+        return self._reload_thread is not None
+
+    def _swap_ledger(self):
+        """Swap in a ledger that has been reloaded in the background.
+
+        Returns True if the ledger has been replaced.
+        """
+        with self._reload_lock:
+            ledger, self._reloaded_ledger = self._reloaded_ledger, None
+        if ledger is None:
+            return False
+        self.ledger = ledger
+        self._reloaded = True
+        return True
+
+    def _filter_entries(self, ledger, key):
+        """Apply the filters with the given values to the ledger's entries.
+
+        The result of every stage of the filtering is cached by the values of
+        the filters applied up to that stage, so only the filters starting
+        from the first one whose value changed have to be applied again.
+        As long as the entries are a selection of all entries, the filters
+        that support it select entries by their positions in the ledger's
+        EntryIndex.
+
+        Returns:
+            A tuple of the filters by name and the filtered entries.
+        """
+        filters = {}
+        entries = ledger.all_entries
+        positions = None
+        for index, (name, filter_class) in enumerate(FILTERS):
+            prefix = key[:index + 1]
+            with self._filter_lock:
+                stage = None
+                if ledger is self._filtered_ledger:
+                    stage = self._filter_stages.get(prefix)
+                if stage is not None:
+                    self._filter_stages.move_to_end(prefix)
+            if stage is None:
+                filter_ = filter_class()
+                filter_.set(key[index])
+                if not filter_:
+                    stage = filter_, positions, entries
+                elif filter_.indexed and (positions is not None or
+                                          entries is ledger.all_entries):
+                    matching = filter_.positions(ledger.entry_index,
+                                                 positions)
+                    stage = (filter_, matching,
+                             ledger.entry_index.select(matching))
+                else:
+                    stage = (filter_, None,
+                             filter_.apply(entries, ledger.options))
+                with self._filter_lock:
+                    if ledger is self._filtered_ledger:
+                        self._filter_stages[prefix] = stage
+                        if len(self._filter_stages) > \
+                                self.FILTER_CACHE_SIZE * len(FILTERS):
+                            self._filter_stages.popitem(last=False)
+            filters[name], positions, entries = stage
+        return filters, entries
+
+    def _filtered_ledger_view(self, ledger, values):
+        """Get the view of the ledger for the given filter values.
+
+        Raises:
+            FilterException: If one of the filter values is invalid.
+        """
+        key = tuple(values.get(name) for name, _ in FILTERS)
+        with self._filter_lock:
+            if ledger is not self._filtered_ledger:
+                self._filtered.clear()
+                self._filter_stages.clear()
+                self._filtered_ledger = ledger
+            view = self._filtered.get(key)
+            if view is not None:
+                self.filter_cache_hits += 1
+                self._filtered.move_to_end(key)
+                return view
+            self.filter_cache_misses += 1
+
+        filters, entries = self._filter_entries(ledger, key)
+        view = FilteredLedger(self.beancount_file_path, ledger, filters,
+                              entries)
+
+        with self._filter_lock:
+            if ledger is self._filtered_ledger:
+                self._filtered[key] = view
+                if len(self._filtered) > self.FILTER_CACHE_SIZE:
+                    self._filtered.popitem(last=False)
+        return view
+
+    def filter(self, **kwargs):
+        """Get a filtered view of the current ledger.
+
+        This is called at the start of every request, so a ledger that has
+        been reloaded in the background is swapped in here and requests that
+        are already being handled keep using the previous one.
+
+        Args:
+            kwargs: The values of the filters (see `FILTERS`), missing ones
+                are not applied.
+
+        Returns:
+            A FilteredLedger.
+
+        Raises:
+            FilterException: If one of the filter values is invalid.
+        """
+        self._swap_ledger()
+        return self._filtered_ledger_view(self.ledger, kwargs)
+
+    def changed(self):
+        """Check if the file needs to be reloaded.
+
+        Changes are reloaded in the background, see `reload_pending`.
+
+        Returns:
+            True if a reloaded ledger has been swapped in since the last call.
+        """
+        if self.watcher.check():
+            self._reload()
+        self._swap_ledger()
+        changed, self._reloaded = self._reloaded, False
+        return changed
+
+    def set_source(self, file_path, source):
+        view = self._filtered_ledger_view(self.ledger, {})
+        if file_path not in view.source_files():
+            raise FavaAPIException('Trying to write a non-source file')
+
+        with open(file_path, 'w+', encoding='utf8') as file:
+            file.write(source)
+        self.load_file()
@@ -1,12 +1,25 @@
-from collections import defaultdict, namedtuple
+import bisect
+import decimal
+from collections import defaultdict, namedtuple, OrderedDict
 
 from beancount.core.number import Decimal
 
-from fava.util.date import days_in_daterange, number_of_days_in_period
+from fava.util.date import get_next_interval, number_of_days_in_period
 
 Budget = namedtuple('Budget', 'account date_start period number currency')
 BudgetError = namedtuple('BudgetError', 'source message entry')
 
+# The interval after which the number of days in a budget's period can change.
+PERIOD_INTERVALS = {
+    'monthly': 'month',
+    'quarterly': 'quarter',
+    'yearly': 'year',
+}
+
+# Used to round to a given quantum, in the same way as additions round.
+HALF_EVEN = decimal.Context(prec=decimal.MAX_PREC,
+                            rounding=decimal.ROUND_HALF_EVEN)
+
 
 def _parse_budget_entry(entry):
     return Budget(
@@ -42,18 +55,208 @@ def parse_budgets(custom_entries):
     return dict(budgets), errors
 
 
-def _matching_budgets(budgets, account_name, date_active):
+def _exponent(number):
+    return number.as_tuple().exponent
+
+
+def _run_total(total, value, steps, prec):
+    """The total after adding value `steps` times or None.
+
+    None is returned if the result of the additions cannot be computed in one
+    go, i.e., if they do not all add the same (rounded) number.  Has to be
+    called in a context that signals inexact results.
     """
-    Returns the budget that is active on the specifed date for the
-    specified account.
+    first = total + value
+    last = total + steps * value
+    exponent = min(_exponent(total), _exponent(value))
+
+    # None of the additions is rounded.
+    if max(first.adjusted(), last.adjusted()) - exponent < prec:
+        return last.quantize(Decimal(1).scaleb(exponent))
+
+    # All additions are rounded to the same quantum.  As long as the total
+    # is a multiple of it, each of them adds the value rounded to it.  If the
+    # value lies halfway between two multiples, this holds if the total is an
+    # even multiple, as the rounded value is one as well.
+    exponent = first.adjusted() - prec + 1
+    quantum = Decimal(1).scaleb(exponent)
+    increment = value.quantize(quantum, context=HALF_EVEN)
+    result = total + steps * increment
+    last = result - increment + value
+    if (not first or first.is_signed() != last.is_signed() or
+            last.adjusted() != first.adjusted() or
+            result.adjusted() != first.adjusted() or
+            total % quantum or
+            min(_exponent(total), _exponent(value)) > exponent or
+            2 * abs(value - increment) > quantum or
+            (2 * abs(value - increment) == quantum and
+             (total / quantum) % 2)):
+        return None
+    return result.quantize(quantum)
+
+
+def _add_repeatedly(total, value, count):
+    """Add value to total `count` times.
+
+    The result is identical to the one of `count` successive additions in the
+    current Decimal context (including all the rounding), but runs of
+    additions that are rounded in the same way are done in one step.
     """
-    last_seen_budgets = {}
-    for budget in budgets[account_name]:
-        if budget.date_start <= date_active:
-            last_seen_budgets[budget.currency] = budget
+    context = decimal.getcontext()
+    # Looping is faster for short runs.
+    if count < 64 or context.rounding != decimal.ROUND_HALF_EVEN:
+        for _ in range(count):
+            total += value
+        return total
+
+    exact = decimal.Context(prec=3 * context.prec + len(str(count)),
+                            traps=[decimal.Inexact, decimal.InvalidOperation])
+
+    def run_total(steps):
+        with decimal.localcontext(exact):
+            try:
+                return _run_total(total, value, steps, context.prec)
+            except decimal.DecimalException:
+                return None
+
+    while count:
+        steps, result = count, run_total(count)
+        if result is None:
+            # Find the longest run that can be done in one step.
+            steps, high = 0, count
+            while steps + 1 < high:
+                middle = (steps + high) // 2
+                run = run_total(middle)
+                if run is None:
+                    high = middle
+                else:
+                    steps, result = middle, run
+        if steps:
+            total = result
+            count -= steps
         else:
-            break
-    return last_seen_budgets
+            total += value
+            count -= 1
+    return total
+
+
+def _budget_totals(budgets, date_from, ends, restart=False):
+    """The budget for one currency up to each of the given dates.
+
+    Args:
+        budgets: The budgets for an account and a single currency, sorted by
+            their start date.
+        date_from: The first day.
+        ends: A sorted list of dates.
+        restart: Whether to start from zero at each of the dates, i.e., to
+            compute the budgets between consecutive dates instead of the
+            budgets since date_from.
+
+    Returns:
+        A list with the budget up to (excluding) each of the dates, computed
+        in the same way as adding up the daily budgets.  The budget is None
+        if there is no active budget on any of the days.
+    """
+    dates = [budget.date_start for budget in budgets]
+    begin = date_from
+    total = None
+    totals = []
+    for date_to in ends:
+        if restart:
+            total = None
+        begin = max(begin, min(dates[0], date_to))
+        while begin < date_to:
+            index = bisect.bisect_right(dates, begin)
+            budget = budgets[index - 1]
+            end = dates[index] if index < len(dates) else date_to
+            end = min(end, date_to)
+            while begin < end:
+                daily = budget.number / number_of_days_in_period(
+                    budget.period, begin)
+                span_end = end
+                if budget.period in PERIOD_INTERVALS:
+                    span_end = min(end, get_next_interval(
+                        begin, PERIOD_INTERVALS[budget.period]))
+                if total is None:
+                    total = Decimal()
+                total = _add_repeatedly(total, daily, (span_end - begin).days)
+                begin = span_end
+        totals.append(total)
+    return totals
+
+
+def _interval_runs(interval_tuples, accumulate):
+    """Split intervals into runs that can be computed in a single pass.
+
+    Returns:
+        A list of (date_from, ends, restart) tuples for `_budget_totals`.
+    """
+    ends = [end for _, end in interval_tuples]
+    if accumulate and ends == sorted(ends):
+        return [(interval_tuples[0][0], ends, False)]
+    if not accumulate and all(
+            previous[1] == interval[0] and interval[0] <= interval[1]
+            for previous, interval in zip(interval_tuples,
+                                          interval_tuples[1:])):
+        return [(interval_tuples[0][0], ends, True)]
+    date_from = interval_tuples[0][0]
+    return [(date_from if accumulate else begin, [end], True)
+            for begin, end in interval_tuples]
+
+
+def budget_matrix(budgets, account_names, interval_tuples, accumulate=False):
+    """Compute the budgets for a set of accounts and a list of intervals.
+
+    For each account and currency, the daily budgets are added up in a single
+    pass over all intervals.  The date range is split at the start dates of
+    the budgets and at the boundaries of their periods, so that the daily
+    budget is constant within each of the resulting spans.
+
+    Args:
+        budgets: A dict of account name to budgets, as from `parse_budgets`.
+        account_names: The account names.
+        interval_tuples: A list of (begin_date, end_date) tuples.
+        accumulate: Whether the budgets should be computed from the begin
+            date of the first interval for all intervals.
+
+    Returns:
+        A dict mapping each of the account names to a list with one dictionary
+        (currency => number) per interval, like `calculate_budget`.
+    """
+    matrix = {}
+    runs = _interval_runs(interval_tuples, accumulate) \
+        if interval_tuples else []
+    if accumulate:
+        starts = [interval_tuples[0][0]] * len(interval_tuples)
+    else:
+        starts = [begin for begin, _ in interval_tuples]
+
+    for account_name in account_names:
+        row = [{} for _ in interval_tuples]
+        matrix[account_name] = row
+        if account_name not in budgets:
+            continue
+
+        by_currency = OrderedDict()
+        for budget in budgets[account_name]:
+            by_currency.setdefault(budget.currency, []).append(budget)
+
+        columns = []
+        for currency, currency_budgets in by_currency.items():
+            totals = []
+            for date_from, ends, restart in runs:
+                totals.extend(_budget_totals(currency_budgets, date_from,
+                                             ends, restart))
+            columns.append((currency_budgets[0].date_start, currency,
+                            totals))
+
+        # The currencies are ordered by the first day their budget is active.
+        for index, start in enumerate(starts):
+            for _, currency, totals in sorted(
+                    columns, key=lambda column: max(start, column[0])):
+                if totals[index] is not None:
+                    row[index][currency] = totals[index]
+    return matrix
 
 
 def calculate_budget(budgets, account_name, date_from, date_to):
@@ -61,15 +264,5 @@ def calculate_budget(budgets, account_name, date_from, date_to):
     Returns a dictionary (currency => number) with the budget for the
     specified account and period (excluding date_to).
     """
-    if account_name not in budgets.keys():
-        return {}
-
-    currency_dict = defaultdict(Decimal)
-
-    for single_day in days_in_daterange(date_from, date_to):
-        matches = _matching_budgets(budgets, account_name, single_day)
-        for budget in matches.values():
-            currency_dict[budget.currency] += \
-                budget.number / number_of_days_in_period(budget.period,
-                                                         single_day)
-    return dict(currency_dict)
+    return budget_matrix(budgets, [account_name],
+                         [(date_from, date_to)])[account_name][0]
@@ -19,6 +19,8 @@ DEFAULTS = {
     'language': None,
     'interval': 'month',
     'editor-insert-marker': None,
+    'parse-cache': False,
+    'reload-quiet-period': 500,
 }
 
 BOOL_OPTS = [
@@ -29,10 +31,12 @@ BOOL_OPTS = [
     'show-closed-accounts',
     'show-accounts-with-zero-balance',
     'show-accounts-with-zero-transactions',
+    'parse-cache',
 ]
 
 INT_OPTS = [
     'editor-print-margin-column',
+    'reload-quiet-period',
     'sidebar-show-queries',
     'uptodate-indicator-grey-lookback-days',
 ]
@@ -1,10 +1,13 @@
+import collections
+import functools
 import re
+import threading
 
-from beancount.core import account
 from beancount.core.data import Transaction
 from beancount.ops import summarize
 from beancount.query import (
     query_compile, query_env, query_execute, query_parser)
+from beancount.utils.bisect_key import bisect_left_with_key
 from fava.util.date import parse_date
 
 
@@ -18,9 +21,49 @@ class FilterException(Exception):
         return self.msg
 
 
+class EntryIndex(object):
+    """Positions of entries by tag, payee and account.
+
+    The positions of the entries in `entries` are stored in ascending order,
+    so filters can select entries using set operations on their positions
+    and the selected entries keep their original order.
+    """
+
+    __slots__ = ['entries', 'tags', 'payees', 'accounts']
+
+    def __init__(self, entries):
+        self.entries = entries
+        tags = collections.defaultdict(list)
+        payees = collections.defaultdict(list)
+        accounts = collections.defaultdict(list)
+
+        for position, entry in enumerate(entries):
+            if isinstance(entry, Transaction):
+                for tag in entry.tags or ():
+                    tags[tag].append(position)
+                payees[entry.payee or ''].append(position)
+                for name in set(posting.account
+                                for posting in entry.postings):
+                    accounts[name].append(position)
+            elif hasattr(entry, 'account'):
+                accounts[entry.account].append(position)
+
+        self.tags = dict(tags)
+        self.payees = dict(payees)
+        self.accounts = dict(accounts)
+
+    def select(self, positions):
+        """The entries at the given positions."""
+        entries = self.entries
+        return [entries[position] for position in positions]
+
+
 class EntryFilter(object):
     """Filters a list of entries. """
 
+    #: Whether the filter supports selecting entries from an EntryIndex.
+    indexed = False
+
     def __init__(self):
         self.value = None
 
@@ -46,16 +89,51 @@ class EntryFilter(object):
         else:
             return entries
 
+    def _matching_positions(self, index):
+        raise NotImplementedError
+
+    def positions(self, index, positions=None):
+        """Positions of the entries of the index that match the filter.
+
+        Only for filters that are `indexed`.
+
+        Args:
+            index: An EntryIndex.
+            positions: If given, only these positions are considered.
+
+        Returns:
+            A sorted list of positions.
+        """
+        matching = self._matching_positions(index)
+        if positions is not None:
+            matching.intersection_update(positions)
+        return sorted(matching)
+
     def __bool__(self):
         return bool(self.value)
 
 
+_PARSER = query_parser.Parser()
+_PARSER_LOCK = threading.Lock()
+_ENV_ENTRIES = query_env.FilterEntriesEnvironment()
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_from(value):
+    """Parse and compile a FROM expression.
+
+    The compiled expressions are cached, as usually only a handful of
+    different ones are used (e.g., in sidebar links).
+    """
+    with _PARSER_LOCK:
+        from_clause = _PARSER.parse('select * from ' + value).from_clause
+    return query_compile.compile_from(from_clause, _ENV_ENTRIES)
+
+
 class FromFilter(EntryFilter):
     """Filter by a FROM expression in the Beancount Query Language. """
     def __init__(self):
         super().__init__()
-        self.parser = query_parser.Parser()
-        self.env_entries = query_env.FilterEntriesEnvironment()
         self.c_from = None
 
     def set(self, value):
@@ -65,10 +143,7 @@ class FromFilter(EntryFilter):
         if not self.value:
             return True
         try:
-            from_clause = self.parser.parse(
-                'select * from ' + value).from_clause
-            self.c_from = query_compile.compile_from(
-                from_clause, self.env_entries)
+            self.c_from = _compile_from(value)
         except (query_compile.CompilationError,
                 query_parser.ParseError) as exception:
             raise FilterException('from', str(exception))
@@ -100,6 +175,10 @@ class TimeFilter(EntryFilter):
         return True
 
     def _filter(self, entries, options):
+        # Clamping truncates the entries at the end date anyway, doing so
+        # first means that the later entries do not have to be looked at.
+        entries = entries[:bisect_left_with_key(
+            entries, self.end_date, key=lambda entry: entry.date)]
         entries, _ = summarize.clamp_opt(entries, self.begin_date,
                                          self.end_date, options)
         return entries
@@ -111,6 +190,8 @@ class TagFilter(EntryFilter):
     Only keeps entries that might have tags (transactions only).
     """
 
+    indexed = True
+
     def __init__(self):
         super().__init__()
         self.tags = set()
@@ -130,30 +211,68 @@ class TagFilter(EntryFilter):
         return isinstance(entry, Transaction) and \
             entry.tags and (entry.tags & self.tags)
 
-
-def _match_account(name, search):
-    return (account.has_component(name, search) or
-            re.match(search, name))
+    def _matching_positions(self, index):
+        return set().union(*[index.tags.get(tag, ()) for tag in self.tags])
 
 
 class AccountFilter(EntryFilter):
     """Filter by account.
 
     The filter string can either a regular expression or a parent account.
+    The patterns are compiled once and every account name is only matched
+    against them once.
     """
 
+    indexed = True
+
+    def __init__(self):
+        super().__init__()
+        self.component_regex = None
+        self.regex = None
+        self.matches = {}
+
+    def set(self, value):
+        if value == self.value:
+            return False
+        self.value = value
+        self.matches = {}
+        if not self.value:
+            return True
+        try:
+            # like `beancount.core.account.has_component`
+            self.component_regex = re.compile('(^|:){}(:|$)'.format(value))
+            self.regex = re.compile(value)
+        except re.error as exception:
+            raise FilterException('account', 'Invalid account filter: {}'
+                                  .format(exception))
+        return True
+
+    def _match(self, name):
+        match = self.matches.get(name)
+        if match is None:
+            match = bool(self.component_regex.search(name) or
+                         self.regex.match(name))
+            self.matches[name] = match
+        return match
+
     def _include_entry(self, entry):
         if isinstance(entry, Transaction):
-            return any(_match_account(posting.account, self.value)
+            return any(self._match(posting.account)
                        for posting in entry.postings)
         else:
-            return (hasattr(entry, 'account') and
-                    _match_account(entry.account, self.value))
+            return hasattr(entry, 'account') and self._match(entry.account)
+
+    def _matching_positions(self, index):
+        return set().union(*[positions for name, positions
+                             in index.accounts.items()
+                             if self._match(name)])
 
 
 class PayeeFilter(EntryFilter):
     """Filter by payee. """
 
+    indexed = True
+
     def __init__(self):
         super().__init__()
         self.payees = []
@@ -173,3 +292,7 @@ class PayeeFilter(EntryFilter):
         return isinstance(entry, Transaction) and \
             ((entry.payee and (entry.payee in self.payees)) or
              (not entry.payee and ('' in self.payees)))
+
+    def _matching_positions(self, index):
+        return set().union(*[index.payees.get(payee, ())
+                             for payee in self.payees])
@@ -1,10 +1,20 @@
-from beancount.core import flags, account_types
+import bisect
+import collections
+import copy
+import datetime
+import sys
+
+from beancount.core import account, flags, account_types
 from beancount.ops.holdings import Holding
 from beancount.core.data import Transaction
 from beancount.core.inventory import Inventory
+from beancount.core.number import ZERO
 from beancount.parser import options
 from beancount.ops import prices
 
+from fava.api.serialization import serialize_inventory
+from fava.util.date import get_next_interval
+
 
 # This really belongs in beancount:src/python/beancount/ops/holdings.py
 def get_holding_from_position(position, price_map=None, date=None):
@@ -107,3 +117,286 @@ def holdings_at_dates(entries, dates, price_map, options_map):
                                                   posting_predicate)):
         yield [get_holding_from_position(position, price_map, date)
                for position in inventory]
+
+
+def interval_balances(entries, dates, account_name, account_names,
+                      interval_tuples, accumulate=False):
+    """Computes the balances of an account tree in multiple intervals.
+
+    The entries are only walked once, the postings are added to the balance
+    of their account in the interval they fall into.
+
+    :param entries: The list of entries, sorted by date.
+    :param dates: The dates of the entries.
+    :param account_name: The name of the root of the account tree.
+    :param account_names: Names of accounts that should be in the tree even
+        if they have no postings.
+    :param interval_tuples: The (begin_date, end_date) tuples of the
+        intervals, as returned by `fava.util.date.interval_tuples`.
+    :param accumulate: Whether the balances should include all the postings
+        since the beginning of the first interval.
+
+    :return: A nested dict with the 'account', its 'children' and, for each
+        interval, a tuple of the serialized balance of the account and the
+        balance including its sub-accounts in 'balance_and_balance_children'.
+        The tree only contains the given accounts and those with postings in
+        the first interval, but the balances of the parent accounts include
+        all sub-accounts.
+    """
+    if not interval_tuples:
+        return None
+
+    count = len(interval_tuples)
+    prefix = account_name + ':'
+    balances = {account_name: [Inventory() for _ in range(count)]}
+    shown = set([account_name])
+
+    def add_account(name, show):
+        """Add the account and its parents to the tree."""
+        while name != account_name:
+            if name not in balances:
+                balances[name] = [Inventory() for _ in range(count)]
+            if show:
+                shown.add(name)
+            name = account.parent(name)
+
+    for name in account_names:
+        if name.startswith(prefix):
+            add_account(name, True)
+
+    outside = set()
+    index = 0
+    for entry in entries[
+            bisect.bisect_left(dates, interval_tuples[0][0]):
+            bisect.bisect_left(dates, interval_tuples[-1][1])]:
+        if not isinstance(entry, Transaction):
+            continue
+        while entry.date >= interval_tuples[index][1]:
+            index += 1
+        for posting in entry.postings:
+            inventories = balances.get(posting.account)
+            if inventories is None or (index == 0 and
+                                       posting.account not in shown):
+                if posting.account in outside:
+                    continue
+                if not posting.account.startswith(prefix):
+                    outside.add(posting.account)
+                    continue
+                add_account(posting.account, index == 0)
+                inventories = balances[posting.account]
+            inventories[index].add_position(posting)
+
+    if accumulate:
+        for inventories in balances.values():
+            for index in range(1, count):
+                inventories[index] = inventories[index - 1] + \
+                    inventories[index]
+
+    # Sum up the balances of the sub-accounts, starting with the leaves.
+    totals = {name: [Inventory().add_inventory(inventory)
+                     for inventory in inventories]
+              for name, inventories in balances.items()}
+    children = collections.defaultdict(list)
+    for name in sorted(balances, key=lambda name: name.count(':'),
+                       reverse=True):
+        if name == account_name:
+            continue
+        parent = account.parent(name)
+        if name in shown:
+            children[parent].append(name)
+        for total, child_total in zip(totals[parent], totals[name]):
+            total.add_inventory(child_total)
+
+    def serialize(name):
+        return {
+            'account': name,
+            'balance_and_balance_children': [
+                (serialize_inventory(balance, at_cost=True),
+                 serialize_inventory(total, at_cost=True))
+                for balance, total in zip(balances[name], totals[name])],
+            'children': [serialize(child) for child in sorted(children[name])],
+        }
+
+    return serialize(account_name)
+
+
+def cumulative_changes(entries, account_name):
+    """Computes the running totals of the postings to an account tree.
+
+    :param entries: The list of entries, sorted by date.
+    :param account_name: The name of the root of the account tree.
+
+    :return: A tuple of the dates on which there are postings to the account
+        or one of its sub-accounts and, for each of these dates, a dict that
+        maps currencies to the total (at cost) of the postings up to and
+        including that date.
+    """
+    prefix = account_name + ':'
+    dates = []
+    cumulative = []
+    totals = {}
+    for entry in entries:
+        if not isinstance(entry, Transaction):
+            continue
+        changed = False
+        for posting in entry.postings:
+            if posting.account != account_name and \
+                    not posting.account.startswith(prefix):
+                continue
+            if posting.cost is None:
+                number = posting.units.number
+                currency = posting.units.currency
+            else:
+                number = posting.units.number * posting.cost.number
+                currency = posting.cost.currency
+            totals[currency] = totals.get(currency, ZERO) + number
+            changed = True
+        if changed:
+            if dates and dates[-1] == entry.date:
+                cumulative[-1] = dict(totals)
+            else:
+                dates.append(entry.date)
+                cumulative.append(dict(totals))
+    return dates, cumulative
+
+
+class BalanceCheckpoints(object):
+    """The balances of all accounts at the start of every month.
+
+    The balance of accounts at some date is then the balance at the last
+    checkpoint before it plus the postings of the (at most one month of)
+    entries since.  Inventories of accounts that did not change between two
+    checkpoints are shared.
+
+    :param entries: The list of entries, sorted by date.
+    :param dates: The dates of the entries.
+    """
+
+    __slots__ = ['entries', 'dates', 'checkpoint_dates', 'indices',
+                 'checkpoints', 'final']
+
+    def __init__(self, entries, dates):
+        self.entries = entries
+        self.dates = dates
+        # The dates of the checkpoints, the index of the first entry on or
+        # after them and the balances of all accounts before that entry.
+        self.checkpoint_dates = []
+        self.indices = []
+        self.checkpoints = []
+
+        balances = {}
+        snapshot = {}
+        changed = set()
+
+        def take_snapshot():
+            new_snapshot = dict(snapshot)
+            for name in changed:
+                new_snapshot[name] = copy.copy(balances[name])
+            changed.clear()
+            return new_snapshot
+
+        next_checkpoint = None
+        for index, entry in enumerate(entries):
+            if next_checkpoint is None or entry.date >= next_checkpoint:
+                checkpoint_date = datetime.date(entry.date.year,
+                                                entry.date.month, 1)
+                snapshot = take_snapshot()
+                self.checkpoint_dates.append(checkpoint_date)
+                self.indices.append(index)
+                self.checkpoints.append(snapshot)
+                next_checkpoint = get_next_interval(checkpoint_date, 'month')
+            if isinstance(entry, Transaction):
+                for posting in entry.postings:
+                    balance = balances.get(posting.account)
+                    if balance is None:
+                        balance = balances[posting.account] = Inventory()
+                    balance.add_position(posting)
+                    changed.add(posting.account)
+        self.final = take_snapshot()
+
+    def _start(self, date):
+        """The snapshot and index of the last checkpoint before date."""
+        checkpoint = bisect.bisect_right(self.checkpoint_dates, date) - 1
+        if checkpoint < 0:
+            return {}, 0
+        return self.checkpoints[checkpoint], self.indices[checkpoint]
+
+    def _replay(self, inventory, predicate, start, stop):
+        """Add the postings of the entries[start:stop] to inventory."""
+        for entry in self.entries[start:stop]:
+            if isinstance(entry, Transaction):
+                for posting in entry.postings:
+                    if predicate is None or predicate(posting.account):
+                        inventory.add_position(posting)
+
+    def balance(self, predicate=None, date=None):
+        """Compute the balance of all postings up to a date.
+
+        This gives the same inventory as
+        `beancount.core.interpolate.compute_entries_balance`, though the
+        order of the positions can differ if multiple accounts match.
+
+        :param predicate: If given, only postings to accounts for whose name
+            this returns True are summed up.
+        :param date: The (exclusive) date at which to stop adding up.
+
+        :return: An Inventory.
+        """
+        if date is None:
+            snapshot = self.final
+            start = stop = len(self.entries)
+        else:
+            snapshot, start = self._start(date)
+            stop = bisect.bisect_left(self.dates, date)
+
+        inventory = Inventory()
+        for name, balance in snapshot.items():
+            if predicate is None or predicate(name):
+                inventory.add_inventory(balance)
+        self._replay(inventory, predicate, start, stop)
+        return inventory
+
+    def balances_at_dates(self, dates, predicate=None):
+        """Generator that yields the balance at each of the given dates.
+
+        The balance at a date is computed from the balance at the previous
+        date if that is not before the last checkpoint, so only the entries
+        between the two dates are replayed.  As in `inventory_at_dates`, the
+        same (modified) Inventory is yielded for these dates.
+
+        :param dates: An iterator of dates, in increasing order.
+        :param predicate: As for `balance`.
+        """
+        inventory = None
+        previous_stop = None
+        for date in dates:
+            snapshot, start = self._start(date)
+            stop = bisect.bisect_left(self.dates, date)
+            if inventory is None or previous_stop < start:
+                inventory = self.balance(predicate, date)
+            else:
+                self._replay(inventory, predicate, previous_stop, stop)
+            previous_stop = stop
+            yield inventory
+
+    def memory_usage(self):
+        """The approximate number of bytes used by the checkpoints.
+
+        Shared inventories and positions are only counted once, the entries
+        are not counted.
+        """
+        size = sum(sys.getsizeof(values) for values in
+                   [self.checkpoint_dates, self.indices, self.checkpoints])
+        seen = set()
+        for snapshot in self.checkpoints + [self.final]:
+            size += sys.getsizeof(snapshot)
+            for inventory in snapshot.values():
+                if id(inventory) in seen:
+                    continue
+                seen.add(id(inventory))
+                size += sys.getsizeof(inventory)
+                for position in inventory:
+                    if id(position) not in seen:
+                        seen.add(id(position))
+                        size += sys.getsizeof(position)
+        return size
@@ -0,0 +1,265 @@
+"""Loading of Beancount files.
+
+Keeps the parse results of the individual files of a ledger around, so that
+on a reload only the files whose contents changed have to be parsed again.
+The result of a load can also be stored in an on-disk cache to speed up the
+startup of Fava.
+"""
+
+import copy
+import hashlib
+import logging
+import os
+import pickle
+import re
+
+from beancount import loader
+from beancount.core import data
+from beancount.ops import validation
+from beancount.parser import booking, options, parser
+from beancount.utils import encryption
+
+import fava
+
+CACHE_FILENAME = '.{filename}.favacache'
+TITLE_RE = re.compile(r'^option\s+"title"\s+"(.*)"', re.MULTILINE)
+
+
+def file_hash(path):
+    """Hash of the contents of the file at path."""
+    with open(path, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def read_title(beancount_file_path):
+    """Read the title option of a Beancount file without loading it.
+
+    Only the options in the main file are used by Beancount, so this does
+    not need to look at included files.
+
+    Returns:
+        The title or None if it is not set (or the file is encrypted).
+    """
+    if encryption.is_encrypted_file(beancount_file_path):
+        return None
+    with open(beancount_file_path, encoding='utf-8') as file:
+        match = TITLE_RE.search(file.read())
+    return match.group(1) if match else None
+
+
+class IncrementalLoader(object):
+    """Loads a Beancount file, only reparsing files that changed.
+
+    The parse results (entries, errors and options) of the main file and of
+    each included file are stored together with the hash of the file's
+    contents.  Booking, plugins and validation are always run on the merged
+    entries, so the result is the same as a full load with
+    `beancount.loader`.
+
+    Encrypted files are loaded with `load_encrypted` instead.
+    """
+
+    __slots__ = ['beancount_file_path', 'parsed', 'parse_count', 'encrypted']
+
+    def __init__(self, beancount_file_path):
+        self.beancount_file_path = beancount_file_path
+        self.parsed = {}
+        self.parse_count = 0
+        self.encrypted = None
+
+    def _parse_file(self, filename):
+        """Parse a single file or take the result from the previous load."""
+        content_hash = file_hash(filename)
+        cached = self.parsed.get(filename)
+        if cached is None or cached[0] != content_hash:
+            self.parse_count += 1
+            cached = (content_hash,) + parser.parse_file(filename)
+            self.parsed[filename] = cached
+        _, entries, errors, options_map = cached
+        return list(entries), list(errors), options_map
+
+    def _parse_recursive(self):
+        """Parse the main file and all its includes.
+
+        This mirrors `beancount.loader._parse_recursive`.
+        """
+        entries, errors = [], []
+        options_map = None
+        source_stack = [os.path.normpath(self.beancount_file_path)]
+        filenames_seen = set()
+
+        while source_stack:
+            filename = source_stack.pop(0)
+
+            if filename in filenames_seen:
+                errors.append(loader.LoadError(
+                    data.new_metadata("<load>", 0),
+                    'Duplicate filename parsed: "{}"'.format(filename), None))
+                continue
+
+            if not os.path.exists(filename):
+                errors.append(loader.LoadError(
+                    data.new_metadata("<load>", 0),
+                    'File "{}" does not exist'.format(filename), None))
+                continue
+
+            filenames_seen.add(filename)
+            src_entries, src_errors, src_options_map = \
+                self._parse_file(filename)
+            entries.extend(src_entries)
+            errors.extend(src_errors)
+
+            # The options of the main file are modified below, so work on a
+            # copy to keep the stored parse result intact.
+            if options_map is None:
+                options_map = copy.deepcopy(src_options_map)
+            else:
+                loader.aggregate_options_map(options_map, src_options_map)
+
+            cwd = os.path.dirname(filename)
+            for include_filename in src_options_map['include']:
+                source_stack.append(os.path.normpath(
+                    os.path.join(cwd, include_filename)))
+
+        if options_map is None:
+            options_map = options.OPTIONS_DEFAULTS.copy()
+        options_map['include'] = sorted(filenames_seen)
+
+        # Forget about files that are not part of the ledger anymore.
+        for filename in set(self.parsed) - filenames_seen:
+            del self.parsed[filename]
+
+        return entries, errors, options_map
+
+    def load_encrypted(self):
+        """Load the file, which is encrypted, with `beancount.loader`.
+
+        The result is kept on the loader (in memory, it is never written to
+        disk) together with the hash of the encrypted file, so loading the
+        file again while it has not changed skips the decryption and parsing.
+        """
+        content_hash = file_hash(self.beancount_file_path)
+        if self.encrypted is None or self.encrypted[0] != content_hash:
+            self.encrypted = (content_hash,
+                              loader.load_file(self.beancount_file_path))
+        return self.encrypted[1]
+
+    def load(self):
+        """Load the file.
+
+        Returns:
+            A triple of (entries, errors, options_map) like
+            `beancount.loader.load_file`.
+        """
+        entries, parse_errors, options_map = self._parse_recursive()
+
+        entries.sort(key=data.entry_sortkey)
+        entries, balance_errors = booking.book(entries, options_map)
+        parse_errors.extend(balance_errors)
+
+        entries, errors = loader.run_transformations(
+            entries, parse_errors, options_map, None)
+        errors.extend(validation.validate(entries, options_map, None, None))
+
+        options_map['input_hash'] = loader.compute_input_hash(
+            options_map['include'])
+
+        return entries, errors, options_map
+
+
+def cache_path(beancount_file_path):
+    """Path of the on-disk cache for the given Beancount file."""
+    return os.path.join(
+        os.path.dirname(beancount_file_path),
+        CACHE_FILENAME.format(
+            filename=os.path.basename(beancount_file_path)))
+
+
+def is_cache_file(path):
+    """Whether the given path is the on-disk cache of some Beancount file."""
+    name = os.path.basename(path)
+    return name.startswith('.') and name.endswith('.favacache')
+
+
+def _read_cache_key(path):
+    """Read the key of the cache at path or None if there is none."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as file:
+            return pickle.load(file)[0]
+    except Exception:  # pylint: disable=broad-except
+        return None
+
+
+def _cache_key(filenames):
+    """Compute the key that a cache for the given files has to match.
+
+    This consists of the content hashes of all files and the versions of
+    Beancount and Fava.
+    """
+    # Beancount has no version attribute, so use the location and mtime of
+    # its (installed) data module, which changes on every upgrade.
+    beancount_stat = os.stat(data.__file__)
+    sha = hashlib.sha1()
+    sha.update('{}{}{}'.format(data.__file__, beancount_stat.st_mtime,
+                               beancount_stat.st_size).encode())
+    sha.update(fava.__version__.encode())
+    for filename in sorted(filenames):
+        sha.update(filename.encode())
+        if os.path.exists(filename):
+            sha.update(file_hash(filename).encode())
+    return sha.hexdigest()
+
+
+def load_cache(beancount_file_path):
+    """Load the cached result for the given file.
+
+    Returns:
+        The cached (entries, errors, options_map) triple or None if there is
+        no cache or it does not match the files on disk.
+    """
+    path = cache_path(beancount_file_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as file:
+            key, filenames = pickle.load(file)
+            if key == _cache_key(filenames):
+                return pickle.load(file)
+    except Exception as exception:  # pylint: disable=broad-except
+        # Unpickling old or corrupted files can fail in many ways.
+        logging.warning('Failed to read cache file %s: %s', path, exception)
+    return None
+
+
+def write_cache(beancount_file_path, result):
+    """Store the result of loading the given file in the on-disk cache.
+
+    The cache is not written again if it is already up to date, so that the
+    write does not show up as a change of a watched folder.
+    """
+    path = cache_path(beancount_file_path)
+    filenames = result[2]['include']
+    key = _cache_key(filenames)
+    if _read_cache_key(path) == key:
+        return
+    try:
+        with open(path, 'wb') as file:
+            # The key is stored first so that it can be checked without
+            # unpickling the entries.
+            pickle.dump((key, filenames), file, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(result, file, pickle.HIGHEST_PROTOCOL)
+    except (OSError, pickle.PicklingError) as exception:
+        logging.warning('Failed to write cache file %s: %s', path, exception)
+
+
+def remove_cache(beancount_file_path):
+    """Remove the on-disk cache for the given file if it exists."""
+    path = cache_path(beancount_file_path)
+    if os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError as exception:
+            logging.warning('Failed to remove cache file %s: %s',
+                            path, exception)
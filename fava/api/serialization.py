@@ -3,6 +3,7 @@ from datetime import date, datetime
 from beancount.core import realization
 from beancount.core.amount import Amount, decimal
 from beancount.core.data import Close, TxnPosting
+from beancount.core.inventory import Inventory
 from beancount.core.position import Position
 from flask.json import JSONEncoder
 
@@ -24,44 +25,62 @@ class BeanJSONEncoder(JSONEncoder):
         return JSONEncoder.default(self, o)
 
 
+def _serialize_units(inventory):
+    return {p.units.currency: p.units.number for p in inventory}
+
+
 def serialize_inventory(inventory, at_cost=False):
     """Renders an Inventory to a currency -> amount dict."""
     if at_cost:
         inventory = inventory.cost()
     else:
         inventory = inventory.units()
-    return {p.units.currency: p.units.number for p in inventory}
+    return _serialize_units(inventory)
 
 
-def serialize_real_account(real_account):
+def _cost_totals(real_account, totals):
+    """Compute the balances at cost of all accounts in a tree bottom-up.
+
+    Args:
+        real_account: A RealAccount.
+        totals: A dict that the (balance, total balance) tuple of Inventories
+            for every account in the tree is added to.  The total balance
+            includes all sub-accounts.
+
+    Returns:
+        The tuple for real_account.
+    """
+    balance = real_account.balance.cost()
+    total = Inventory().add_inventory(balance)
+    for _, child in sorted(real_account.items()):
+        total.add_inventory(_cost_totals(child, totals)[1])
+    totals[real_account.account] = (balance, total)
+    return balance, total
+
+
+def _serialize_real_account(real_account, totals):
+    balance, total = totals[real_account.account]
     return {
         'account': real_account.account,
-        'balance_children':
-            serialize_inventory(realization.compute_balance(real_account),
-                                at_cost=True),
-        'balance': serialize_inventory(real_account.balance, at_cost=True),
+        'balance_children': _serialize_units(total),
+        'balance': _serialize_units(balance),
         'is_leaf': len(real_account) == 0 or bool(real_account.txn_postings),
         'is_closed': isinstance(realization.find_last_active_posting(
             real_account.txn_postings), Close),
         'has_transactions': any(isinstance(t, TxnPosting)
                                 for t in real_account.txn_postings),
-        'children': [serialize_real_account(a)
-                     for n, a in sorted(real_account.items())],
+        'children': [_serialize_real_account(child, totals)
+                     for _, child in sorted(real_account.items())],
     }
 
 
-def zip_real_accounts(ra_list):
-    if not ra_list:
-        return
-    first = ra_list[0]
-    return {
-        'account': first.account,
-        'balance_and_balance_children':
-            [(serialize_inventory(ra.balance, at_cost=True),
-              serialize_inventory(realization.compute_balance(ra),
-                                  at_cost=True))
-             for ra in ra_list],
-        'children': [zip_real_accounts([realization.get(ra, n)
-                                        for ra in ra_list])
-                     for n, a in sorted(first.items())],
-    }
+def serialize_real_account(real_account):
+    """Serialize a realized account tree.
+
+    The balances of the sub-accounts are only converted to cost once and
+    the totals are computed bottom-up, instead of walking the subtree of
+    every account with `realization.compute_balance`.
+    """
+    totals = {}
+    _cost_totals(real_account, totals)
+    return _serialize_real_account(real_account, totals)
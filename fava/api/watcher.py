@@ -1,8 +1,18 @@
-"""A simple file and folder watcher. """
+"""File and folder watchers. """
 
+import logging
 import os
+import threading
 import time
 
+from fava.api.loading import is_cache_file
+
+try:
+    from inotify_simple import INotify, flags
+    HAVE_INOTIFY = True
+except (ImportError, AttributeError, OSError):  # pragma: no cover
+    HAVE_INOTIFY = False
+
 
 class Watcher(object):
     """A simple file and folder watcher.
@@ -19,10 +29,12 @@ class Watcher(object):
         self.last_checked = time.time()
 
     def update(self, files, folders):
-        """Update the folders/files to watch. """
+        """Update the folders/files to watch.
+
+        Changes since the last check are still reported by the next check.
+        """
         self.files = [path for path in files]
         self.folders = [path for path in folders]
-        self.last_checked = time.time()
 
     def check(self):
         """Checks for changes. """
@@ -37,3 +49,100 @@ class Watcher(object):
                     return True
         self.last_checked = time.time()
         return False
+
+
+class InotifyWatcher(object):
+    """A file and folder watcher using inotify (Linux only).
+
+    The kernel records the changes, so a check only has to look at the
+    events that occurred since the last check and does not touch the file
+    system.  Unlike `Watcher`, this also notices changes to files inside the
+    watched folders.
+
+    Files are watched through their parent directories, so that editors that
+    replace a file on saving are handled.  Writes to the on-disk cache of
+    ledgers are ignored, as they are the result of a load.
+    """
+
+    __slots__ = ['files', 'folders', 'inotify', 'paths', 'folder_paths',
+                 'lock', 'pending']
+
+    MASK = (flags.CREATE | flags.DELETE | flags.MODIFY | flags.MOVED_FROM |
+            flags.MOVED_TO | flags.DELETE_SELF | flags.MOVE_SELF
+            if HAVE_INOTIFY else 0)
+
+    def __init__(self):
+        self.files = set()
+        self.folders = set()
+        self.inotify = INotify()
+        self.paths = {}
+        self.folder_paths = set()
+        self.lock = threading.Lock()
+        self.pending = False
+
+    def _add_watch(self, path):
+        try:
+            self.paths[self.inotify.add_watch(path, self.MASK)] = path
+        except OSError as exception:
+            logging.warning('Failed to watch %s: %s', path, exception)
+
+    def _add_folder(self, path):
+        for dirpath, _, _ in os.walk(path):
+            self.folder_paths.add(dirpath)
+            self._add_watch(dirpath)
+
+    def update(self, files, folders):
+        """Update the folders/files to watch.
+
+        Changes since the last check are still reported by the next check.
+        """
+        with self.lock:
+            files = set(files)
+            folders = set(folders)
+            if files != self.files or folders != self.folders:
+                self.pending = self._read_changes()
+                self.inotify.close()
+                self.inotify = INotify()
+                self.paths = {}
+                self.folder_paths = set()
+                self.files = files
+                self.folders = folders
+                for path in set(os.path.dirname(path) for path in files):
+                    self._add_watch(path)
+                for path in folders:
+                    self._add_folder(path)
+
+    def _is_relevant(self, event):
+        dirpath = self.paths.get(event.wd)
+        if dirpath is None or is_cache_file(event.name):
+            return False
+        if dirpath in self.folder_paths:
+            if event.mask & flags.ISDIR and \
+                    event.mask & (flags.CREATE | flags.MOVED_TO):
+                self._add_folder(os.path.join(dirpath, event.name))
+            return True
+        return os.path.join(dirpath, event.name) in self.files
+
+    def _read_changes(self):
+        changed = False
+        for event in self.inotify.read(timeout=0):
+            if self._is_relevant(event):
+                changed = True
+        return changed
+
+    def check(self):
+        """Checks for changes. """
+        with self.lock:
+            changed = self._read_changes() or self.pending
+            self.pending = False
+            return changed
+
+
+def get_watcher():
+    """Create a watcher, using inotify if it is available."""
+    if HAVE_INOTIFY:
+        try:
+            return InotifyWatcher()
+        except OSError:  # pragma: no cover
+            pass
+    return Watcher()  # pragma: no cover
@@ -1,7 +1,12 @@
 # -*- coding: utf-8 -*-
+from collections import OrderedDict
 import datetime
+from functools import partial
 import inspect
+import multiprocessing
 import os
+import threading
+import time
 
 from flask import (abort, Flask, flash, render_template, url_for, request,
                    redirect, send_from_directory, g, send_file, jsonify,
@@ -14,8 +19,9 @@ from beancount.query import query_compile, query_parser
 from beancount.scripts.format import align_beancount
 
 from fava import template_filters
-from fava.api import BeancountReportAPI
+from fava.api import BeancountReportAPI, preload
 from fava.api.filters import FilterException
+from fava.api.loading import read_title
 from fava.api.serialization import BeanJSONEncoder
 from fava.docs import HELP_PAGES
 from fava.util import slugify, resource_path
@@ -37,6 +43,27 @@ app.config['HELP_DIR'] = resource_path('docs')
 app.config['HAVE_EXCEL'] = HAVE_EXCEL
 app.config['HELP_PAGES'] = HELP_PAGES
 app.config['APIS'] = {}
+app.config['FILE_PATHS'] = OrderedDict()
+app.config['FILE_TITLES'] = {}
+app.config['PARSE_CACHE'] = False
+app.config['LAZY_LOAD'] = False
+app.config['UNLOAD_AFTER'] = 0
+app.config['MAX_LOADED'] = 0
+
+# The time each file was last accessed.
+_LAST_ACCESS = {}
+_LOAD_LOCK = threading.Lock()
+# Per-file locks, so that each file is only loaded once at a time.
+_FILE_LOCKS = {}
+# The progress of the initial load, see `load_file`.
+_LOAD_STATUS = {
+    'ready': False,
+    'loaded': 0,
+    'total': 0,
+    'start': None,
+    'duration': None,
+    'error': None,
+}
 
 REPORTS = [
     'balance_sheet',
@@ -53,14 +80,138 @@ REPORTS = [
 ]
 
 
+def _slug(title, filepath):
+    slug = slugify(title) if title else None
+    return slug or slugify(filepath)
+
+
+def _process_context():
+    """A multiprocessing context that does not fork this (multi-threaded)
+    process.
+
+    Forking while other threads hold locks (e.g. of the logging module) can
+    deadlock the child processes.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    method = 'forkserver' if 'forkserver' in methods else 'spawn'
+    return multiprocessing.get_context(method)
+
+
 def load_file():
-    for filepath in app.config['BEANCOUNT_FILES']:
-        api = BeancountReportAPI(filepath)
-        slug = slugify(api.options['title'])
-        if not slug:
-            slug = slugify(filepath)
-        app.config['APIS'][slug] = api
-    app.config['FILE_SLUGS'] = list(app.config['APIS'].keys())
+    """Load the Beancount files.
+
+    If there are several files, they are loaded in parallel in a process
+    pool and the loaded ledgers are sent back to this process.  With
+    LAZY_LOAD, only the first file is loaded and the others are loaded when
+    they are accessed for the first time (see `get_api`).
+
+    Until this is done, all pages except the readiness endpoint only show
+    a loading page, so this can be run in a background thread.
+    """
+    filepaths = app.config['BEANCOUNT_FILES']
+    use_cache = app.config['PARSE_CACHE']
+    if app.config['LAZY_LOAD']:
+        load_paths = filepaths[:1]
+    else:
+        load_paths = filepaths
+    _LOAD_STATUS.update(ready=False, loaded=0, total=len(load_paths),
+                        start=time.time(), duration=None, error=None)
+
+    pool = None
+    try:
+        if len(load_paths) > 1:
+            pool = _process_context().Pool()
+            preloaded = pool.imap(partial(preload, use_cache=use_cache),
+                                  load_paths)
+        else:
+            preloaded = [None] * len(load_paths)
+
+        for filepath, result in zip(load_paths, preloaded):
+            api = BeancountReportAPI(filepath, use_cache, result)
+            slug = _slug(api.options['title'], filepath)
+            app.config['APIS'][slug] = api
+            app.config['FILE_PATHS'][slug] = filepath
+            app.config['FILE_TITLES'][slug] = api.title
+            _LAST_ACCESS[slug] = time.time()
+            _LOAD_STATUS['loaded'] += 1
+    except Exception as exception:
+        _LOAD_STATUS['error'] = str(exception)
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    for filepath in filepaths[len(load_paths):]:
+        title = read_title(filepath)
+        slug = _slug(title, filepath)
+        app.config['FILE_PATHS'][slug] = filepath
+        app.config['FILE_TITLES'][slug] = title
+    app.config['FILE_SLUGS'] = list(app.config['FILE_PATHS'].keys())
+    _LOAD_STATUS.update(ready=True,
+                        duration=time.time() - _LOAD_STATUS['start'])
+
+
+def load_status():
+    """The progress of loading the Beancount files at startup."""
+    status = {
+        'ready': _LOAD_STATUS['ready'],
+        'loaded': _LOAD_STATUS['loaded'],
+        'total': _LOAD_STATUS['total'],
+        'duration': _LOAD_STATUS['duration'],
+    }
+    if not status['ready'] and _LOAD_STATUS['start']:
+        status['duration'] = time.time() - _LOAD_STATUS['start']
+    if _LOAD_STATUS['error']:
+        status['error'] = _LOAD_STATUS['error']
+    return status
+
+
+def _unload_idle_apis(current_slug):
+    """Remove ledgers that have not been accessed for a while.
+
+    The first file and the current one are always kept loaded.  Unloaded
+    files are loaded again when they are accessed.
+    """
+    slugs = [slug for slug in app.config['APIS']
+             if slug not in (app.config['FILE_SLUGS'][0], current_slug)]
+    slugs.sort(key=_LAST_ACCESS.get)
+    if app.config['UNLOAD_AFTER']:
+        idle_since = time.time() - app.config['UNLOAD_AFTER']
+        for slug in list(slugs):
+            if _LAST_ACCESS[slug] < idle_since:
+                del app.config['APIS'][slug]
+                slugs.remove(slug)
+    if app.config['MAX_LOADED']:
+        while slugs and len(app.config['APIS']) > app.config['MAX_LOADED']:
+            del app.config['APIS'][slugs.pop(0)]
+
+
+def get_api(slug):
+    """Get the BeancountReportAPI for the given file, loading it if needed.
+
+    The global lock is only held for the bookkeeping, so loading a file does
+    not block the requests for other files.  Concurrent first accesses to
+    the same file wait for a single load.
+    """
+    with _LOAD_LOCK:
+        _LAST_ACCESS[slug] = time.time()
+        api = app.config['APIS'].get(slug)
+        file_lock = _FILE_LOCKS.setdefault(slug, threading.Lock())
+
+    if api is None:
+        with file_lock:
+            api = app.config['APIS'].get(slug)
+            if api is None:
+                api = BeancountReportAPI(app.config['FILE_PATHS'][slug],
+                                         app.config['PARSE_CACHE'])
+                with _LOAD_LOCK:
+                    app.config['APIS'][slug] = api
+                    app.config['FILE_TITLES'][slug] = api.title
+
+    with _LOAD_LOCK:
+        _unload_idle_apis(slug)
+    return api
 
 
 babel = Babel(app)
@@ -68,8 +219,9 @@ babel = Babel(app)
 
 @babel.localeselector
 def get_locale():
-    if app.config['language']:
-        return app.config['language']
+    ledger = getattr(g, 'ledger', None)
+    if ledger is not None and ledger.fava_options['language']:
+        return ledger.fava_options['language']
     return request.accept_languages.best_match(['de', 'en'])
 
 
@@ -90,7 +242,7 @@ def url_for_current(**kwargs):
 def url_for_source(**kwargs):
     args = request.view_args.copy()
     args.update(kwargs)
-    if app.config['use-external-editor']:
+    if g.ledger.fava_options['use-external-editor']:
         if 'line' in args:
             return "beancount://%(file_path)s?lineno=%(line)d" % args
         else:
@@ -100,16 +252,35 @@ def url_for_source(**kwargs):
         return url_for('report', **args)
 
 
+@app.template_global()
+def beancount_files():
+    """The slugs and titles of all Beancount files."""
+    return [(slug, app.config['FILE_TITLES'][slug])
+            for slug in app.config['FILE_SLUGS']]
+
+
 @app.context_processor
 def template_context():
+    if g.api is None:
+        return {}
     return {
-        'api': g.api,
-        'operating_currencies': g.api.options['operating_currency'],
+        'api': g.ledger,
+        'operating_currencies': g.ledger.options['operating_currency'],
         'datetime': datetime,
-        'interval': request.args.get('interval', app.config['interval']),
+        'interval': request.args.get('interval',
+                                     g.ledger.fava_options['interval']),
     }
 
 
+@app.before_request
+def show_loading_page():
+    # Decide by g.api, which `pull_beancount_file` set from the same check
+    # of the load status, in case loading finished in the meantime.
+    if g.api is not None or request.endpoint in ('healthz', 'static'):
+        return None
+    return render_template('loading.html', status=load_status()), 503
+
+
 @app.before_request
 def csrf_protect():
     if request.method == "POST":
@@ -125,6 +296,9 @@ def csrf_protect():
 
 @app.before_request
 def perform_global_filters():
+    if g.api is None:
+        return
+
     if not g.api.options['operating_currency']:
         flash('No operating currency specified. '
               'Please add one to your beancount file.')
@@ -134,11 +308,16 @@ def perform_global_filters():
         for name in ['account', 'from', 'interval', 'payee', 'tag', 'time']
     }
 
-    try:
-        g.api.filter(**g.filters)
-    except FilterException as exception:
-        g.filters[exception.filter_type] = None
-        flash(str(exception))
+    # Invalid filters are dropped one by one until the view can be built.
+    while True:
+        try:
+            g.ledger = g.api.filter(**g.filters)
+            break
+        except FilterException as exception:
+            if g.filters.get(exception.filter_type) is None:
+                raise
+            g.filters[exception.filter_type] = None
+            flash(str(exception))
 
 
 @app.url_defaults
@@ -157,13 +336,24 @@ def inject_filters(endpoint, values):
 
 @app.url_value_preprocessor
 def pull_beancount_file(_, values):
+    if not _LOAD_STATUS['ready']:
+        g.beancount_file_slug = None
+        g.api = None
+        g.ledger = None
+        return
     g.beancount_file_slug = values.pop('bfile', None) if values else None
     if not g.beancount_file_slug:
         g.beancount_file_slug = app.config['FILE_SLUGS'][0]
     if g.beancount_file_slug not in app.config['FILE_SLUGS']:
         abort(404)
-    g.api = app.config['APIS'][g.beancount_file_slug]
-    app.config.update(g.api.fava_options)
+    g.api = get_api(g.beancount_file_slug)
+
+
+@app.route('/healthz')
+def healthz():
+    """Readiness endpoint, only returns 200 once all files are loaded."""
+    status = load_status()
+    return jsonify(status), 200 if status['ready'] else 503
 
 
 @app.route('/')
@@ -187,7 +377,7 @@ def account(name, subreport='journal'):
 @app.route('/<bfile>/document/', methods=['GET'])
 def document():
     document_path = request.args.get('file_path', None)
-    if document_path and g.api.is_valid_document(document_path):
+    if document_path and g.ledger.is_valid_document(document_path):
         # metadata-statement-paths may be relative to the beancount-file
         if not os.path.isabs(document_path):
             document_path = os.path.join(os.path.dirname(
@@ -218,7 +408,7 @@ def query():
         return render_template('query.html')
 
     try:
-        types, rows = g.api.query(query_string)
+        types, rows = g.ledger.query(query_string)
     except (query_compile.CompilationError, query_parser.ParseError) as error:
         return render_template('query.html', error=error)
 
@@ -238,7 +428,7 @@ def download_query(result_format, name='query_result'):
     query_string = request.args.get('query_string', '')
 
     try:
-        types, rows = g.api.query(query_string, numberify=True)
+        types, rows = g.ledger.query(query_string, numberify=True)
     except (query_compile.CompilationError, query_parser.ParseError):
         abort(400)
 
@@ -267,13 +457,15 @@ def help_page(page_slug='_index'):
 
 @app.route('/<bfile>/api/changed/')
 def api_changed():
-    return jsonify({'success': True, 'changed': g.api.changed()})
+    changed = g.api.changed()
+    return jsonify({'success': True, 'changed': changed,
+                    'pending': g.api.reload_pending})
 
 
 @app.route('/<bfile>/api/source/', methods=['GET', 'POST'])
 def api_source():
     if request.method == "GET":
-        return g.api.source(request.args.get('file_path', None))
+        return g.ledger.source(request.args.get('file_path', None))
     elif request.method == "POST":
         g.api.set_source(request.form['file_path'], request.form['source'])
         return jsonify({'success': True})
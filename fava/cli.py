@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import os
 import errno
+import threading
 
 import click
 from werkzeug.wsgi import DispatcherMiddleware
@@ -9,6 +10,13 @@ from fava.application import app, load_file
 from fava.util import simple_wsgi
 
 
+def _load_file():
+    load_file()
+    for api in app.config['APIS'].values():
+        click.echo('Loaded {} in {:.2f}s'.format(api.beancount_file_path,
+                                                 api.load_duration))
+
+
 @click.command()
 @click.argument('filenames', nargs=-1,
                 type=click.Path(exists=True, resolve_path=True))
@@ -18,6 +26,17 @@ from fava.util import simple_wsgi
               help='The host to listen on. (default: localhost)')
 @click.option('--prefix', type=str,
               help='Set an URL prefix. (for reverse proxy)')
+@click.option('--parse-cache', is_flag=True,
+              help='Cache the parsed Beancount files on disk.')
+@click.option('--lazy-load', is_flag=True,
+              help='Only load the first file at startup and the others when '
+              'they are first accessed.')
+@click.option('--unload-after', type=int, default=0,
+              help='Unload files (except the first) that have not been '
+              'accessed for this many seconds. (default: never)')
+@click.option('--max-loaded', type=int, default=0,
+              help='Maximum number of files to keep loaded, the least '
+              'recently used files are unloaded. (default: no limit)')
 @click.option('-d', '--debug', is_flag=True,
               help='Turn on debugging. Disables live-reloading.')
 @click.option('--profile', is_flag=True,
@@ -26,7 +45,8 @@ from fava.util import simple_wsgi
               help='Output directory for profiling data.')
 @click.option('--profile-restriction', type=int, default=30,
               help='Number of functions to show in profile.')
-def main(filenames, port, host, prefix, debug, profile, profile_dir,
+def main(filenames, port, host, prefix, parse_cache, lazy_load,
+         unload_after, max_loaded, debug, profile, profile_dir,
          profile_restriction):
     """Start fava for FILENAMES on http://host:port."""
 
@@ -43,8 +63,14 @@ def main(filenames, port, host, prefix, debug, profile, profile_dir,
         raise click.UsageError('No file specified')
 
     app.config['BEANCOUNT_FILES'] = filenames
+    app.config['PARSE_CACHE'] = parse_cache
+    app.config['LAZY_LOAD'] = lazy_load
+    app.config['UNLOAD_AFTER'] = unload_after
+    app.config['MAX_LOADED'] = max_loaded
 
-    load_file()
+    # Load in the background so that the server starts right away. Until
+    # loading is done, a loading page is shown.
+    threading.Thread(target=_load_file, daemon=True).start()
 
     if prefix:
         app.wsgi_app = DispatcherMiddleware(simple_wsgi,
@@ -62,7 +88,7 @@ def main(filenames, port, host, prefix, debug, profile, profile_dir,
         app.jinja_env.auto_reload = True
 
     try:
-        app.run(host, port, debug)
+        app.run(host, port, debug, threaded=True)
     except OSError as error:
         if error.errno == errno.EADDRINUSE:
             raise click.UsageError(
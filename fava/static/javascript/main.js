@@ -151,13 +151,18 @@ function initRouter() {
 }
 
 function doPoll() {
+  let pollInterval = 5000;
   $.get(window.changedUrl, (data) => {
     if (data.success && data.changed) {
       $('#reload-page').toggleClass('hidden', false);
       $('aside').load(`/${Backbone.history.fragment} aside`);
     }
+    if (data.success && data.pending) {
+      // the file is being reloaded in the background, check again soon.
+      pollInterval = 1000;
+    }
   })
-    .always(() => { setTimeout(doPoll, 5000); });
+    .always(() => { setTimeout(doPoll, pollInterval); });
 }
 
 $(document).ready(() => {
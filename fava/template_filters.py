@@ -22,8 +22,8 @@ def format_currency(value, currency=None, show_if_zero=False):
     if not value and not show_if_zero:
         return ''
     if value == 0.0:
-        return g.api.quantize(Decimal(0.0), currency)
-    return g.api.quantize(value, currency)
+        return g.ledger.quantize(Decimal(0.0), currency)
+    return g.ledger.quantize(value, currency)
 
 
 def format_amount(amount):
@@ -44,14 +44,15 @@ def account_level(account_name):
 def show_account(account):
     show_this_account = False
     if account['is_leaf']:
+        fava_options = g.ledger.fava_options
         show_this_account = True
-        if not g.api.fava_options['show-closed-accounts'] and \
+        if not fava_options['show-closed-accounts'] and \
                 account['is_closed']:
             show_this_account = False
-        if not g.api.fava_options['show-accounts-with-zero-balance'] and \
+        if not fava_options['show-accounts-with-zero-balance'] and \
                 not account['balance']:
             show_this_account = False
-        if not g.api.fava_options['show-accounts-with-zero-transactions'] and \
+        if not fava_options['show-accounts-with-zero-transactions'] and \
                 not account['has_transactions']:
             show_this_account = False
     return show_this_account or any(
@@ -64,15 +65,15 @@ def basename(file_path):
 
 def should_collapse_account(account_name):
     key = 'fava-collapse-account'
-    if key in g.api.account_metadata(account_name):
-        return g.api.account_metadata(account_name)[key] == 'True'
+    if key in g.ledger.account_metadata(account_name):
+        return g.ledger.account_metadata(account_name)[key] == 'True'
     else:
         return False
 
 
 def uptodate_eligible(account_name):
     key = 'fava-uptodate-indication'
-    if key in g.api.account_metadata(account_name):
-        return g.api.account_metadata(account_name)[key] == 'True'
+    if key in g.ledger.account_metadata(account_name):
+        return g.ledger.account_metadata(account_name)[key] == 'True'
     else:
         return False
@@ -24,6 +24,24 @@ def slugify(string):
     return string
 
 
+class cached_property(object):  # pylint: disable=invalid-name
+    """A property that is only computed once per instance.
+
+    The computed value is stored in the instance's __dict__, where it takes
+    precedence over the property on subsequent lookups.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.func.__name__] = self.func(obj)
+        return value
+
+
 def simple_wsgi(_, start_response):
     """A simple wsgi app that always returns an empty response."""
     start_response('200 OK', [('Content-Type', 'text/html')])
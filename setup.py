@@ -46,7 +46,10 @@ setup(
             'pyexcel-ods3>=0.1.1',
             'pyexcel-xls>=0.1.0',
             'pyexcel-xlsx>=0.1.0',
-        ]
+        ],
+        'inotify': [
+            'inotify_simple>=1.0',
+        ],
     },
     zip_safe=False,
     classifiers=[
@@ -1,3 +1,15 @@
+import datetime
+import pickle
+import time
+
+from beancount.core import compare, flags
+import pytest
+
+import fava.api
+from fava.api import BeancountReportAPI, Ledger, preload
+from fava.api.filters import FilterException
+
+
 def test_accounts(example_api):
     assert len(example_api.all_accounts) == 93
     assert len(example_api.all_accounts_active) == 61
@@ -29,3 +41,247 @@ def test_account_uptodate_status(example_api):
 
     status = example_api.account_uptodate_status('Liabilities:US:Chase:Slate')
     assert status == 'green'
+
+
+def test_net_worth_unrealized(tmpdir):
+    ledger = tmpdir.join('ledger.beancount')
+    ledger.write('option "operating_currency" "USD"\n'
+                 'plugin "beancount.plugins.unrealized" "Unrealized"\n'
+                 '2015-01-01 open Assets:Cash\n'
+                 '2015-01-01 open Assets:Stock\n'
+                 '2015-01-01 open Income:Salary\n'
+                 '2015-01-05 * "Salary"\n'
+                 '  Assets:Cash  1000 USD\n'
+                 '  Income:Salary\n'
+                 '2015-02-01 * "Buy"\n'
+                 '  Assets:Stock  10 HOOL {50 USD}\n'
+                 '  Assets:Cash\n'
+                 '2015-03-01 price HOOL 70 USD\n'
+                 '2015-03-15 * "Salary"\n'
+                 '  Assets:Cash  100 USD\n'
+                 '  Income:Salary\n')
+    api = BeancountReportAPI(str(ledger))
+    assert any(entry.flag == flags.FLAG_UNREALIZED
+               for entry in api.all_entries if hasattr(entry, 'flag'))
+    net_worth = api.filter(time='2015').net_worth_at_intervals('year')
+    # the unrealized gains are already included in the market value
+    assert net_worth[-1] == {'date': datetime.date(2016, 1, 1),
+                             'balance': {'USD': 1300}}
+
+
+def test_background_reload(tmpdir):
+    ledger_file = tmpdir.join('test.beancount')
+    ledger_file.write('2016-01-01 open Assets:Cash\n')
+    api = BeancountReportAPI(str(ledger_file))
+    old_ledger = api.ledger
+    assert not api.changed()
+
+    # time.time is too precise
+    time.sleep(1)
+    ledger_file.write('2016-01-01 open Assets:Cash\n'
+                      '2016-01-01 open Assets:Bank\n')
+
+    # block the reload until the old ledger has been checked
+    with api._load_lock:
+        assert not api.changed()
+        assert api.reload_pending
+        reload_thread = api._reload_thread
+        assert api.ledger is old_ledger
+    reload_thread.join()
+    assert not api.reload_pending
+    assert api.ledger is old_ledger
+
+    view = api.filter()
+    assert api.ledger is not old_ledger
+    assert view.ledger is api.ledger
+    assert len(api.all_entries) == 2
+    assert len(view.entries) == 2
+    assert api.changed()
+    assert not api.changed()
+
+
+def test_background_reload_error(tmpdir, monkeypatch):
+    ledger_file = tmpdir.join('test.beancount')
+    ledger_file.write('2016-01-01 open Assets:Cash\n')
+    api = BeancountReportAPI(str(ledger_file))
+
+    def failing_load_ledger(*args):
+        raise OSError('Failed to read file')
+
+    load_ledger = fava.api.load_ledger
+    monkeypatch.setattr(fava.api, 'load_ledger', failing_load_ledger)
+    time.sleep(1)
+    ledger_file.write('2016-01-01 open Assets:Cash\n'
+                      '2016-01-01 open Assets:Bank\n')
+    assert not api.changed()
+    api._reload_thread.join()
+    assert not api.reload_pending
+    assert len(api.filter().entries) == 1
+
+    monkeypatch.setattr(fava.api, 'load_ledger', load_ledger)
+    time.sleep(1)
+    ledger_file.write('2016-01-01 open Assets:Cash\n'
+                      '2016-01-01 open Assets:Bank\n'
+                      '2016-01-01 open Assets:Checking\n')
+    api.changed()
+    assert api.reload_pending
+    api._reload_thread.join()
+    assert not api.reload_pending
+    assert len(api.filter().entries) == 3
+
+
+def test_change_during_reload(tmpdir, monkeypatch):
+    ledger_file = tmpdir.join('test.beancount')
+    ledger_file.write('2016-01-01 open Assets:Cash\n')
+    api = BeancountReportAPI(str(ledger_file))
+    load_ledger = fava.api.load_ledger
+
+    def load_ledger_and_write(*args):
+        ledger = load_ledger(*args)
+        monkeypatch.setattr(fava.api, 'load_ledger', load_ledger)
+        time.sleep(1)
+        ledger_file.write('2016-01-01 open Assets:Cash\n'
+                          '2016-01-01 open Assets:Bank\n'
+                          '2016-01-01 open Assets:Checking\n')
+        return ledger
+
+    monkeypatch.setattr(fava.api, 'load_ledger', load_ledger_and_write)
+    time.sleep(1)
+    ledger_file.write('2016-01-01 open Assets:Cash\n'
+                      '2016-01-01 open Assets:Bank\n')
+    api.changed()
+    api._reload_thread.join()
+    assert len(api.filter().entries) == 2
+
+    api.changed()
+    assert api.reload_pending
+    api._reload_thread.join()
+    assert len(api.filter().entries) == 3
+
+
+def test_reload_quiet_period(tmpdir):
+    ledger_file = tmpdir.join('test.beancount')
+    ledger_file.write('2016-01-01 custom "fava-option" '
+                      '"reload-quiet-period" "300"\n')
+    api = BeancountReportAPI(str(ledger_file))
+    assert api.loader.parse_count == 1
+
+    time.sleep(1)
+    ledger_file.write('2016-01-01 custom "fava-option" '
+                      '"reload-quiet-period" "300"\n'
+                      '2016-01-01 open Assets:Cash\n')
+    api.changed()
+    reload_thread = api._reload_thread
+
+    time.sleep(0.1)
+    ledger_file.write('2016-01-01 custom "fava-option" '
+                      '"reload-quiet-period" "300"\n'
+                      '2016-01-01 open Assets:Cash\n'
+                      '2016-01-01 open Assets:Bank\n')
+    reload_thread.join()
+
+    assert api.loader.parse_count == 2
+    api.filter()
+    assert len(api.all_entries) == 3
+
+
+def test_preload(example_api):
+    preloaded = pickle.loads(pickle.dumps(
+        preload(example_api.beancount_file_path)))
+    api = BeancountReportAPI(example_api.beancount_file_path,
+                             preloaded=preloaded)
+    assert api.load_duration == preloaded[2]
+    assert api.all_entries == example_api.all_entries
+    assert len(api.filter().entries) == len(example_api.entries)
+
+
+def test_ledger_lazy_attributes(example_api):
+    ledger = Ledger(example_api.all_entries, [], example_api.options)
+    assert 'all_root_account' not in ledger.__dict__
+    assert ledger.all_accounts == example_api.all_accounts
+    assert 'all_root_account' in ledger.__dict__
+    assert 'price_map' not in ledger.__dict__
+
+
+def test_entry_hashes(example_api):
+    ledger = Ledger(example_api.all_entries, [], example_api.options)
+    entry = ledger.all_entries[10]
+    ehash = compare.hash_entry(entry)
+    assert 'entry_hashes' not in ledger.__dict__
+    assert ledger.entries_by_hash[ehash] == [entry]
+    assert len(ledger.entry_hashes) == len(ledger.all_entries)
+
+    assert example_api.hash_entry(entry) == ehash
+    changed = entry._replace(date=datetime.date(2000, 1, 1))
+    assert example_api.hash_entry(changed) == compare.hash_entry(changed)
+    assert example_api.hash_entry(changed) != ehash
+
+    unpickled = pickle.loads(pickle.dumps(ledger))
+    assert 'entry_hashes' not in unpickled.__dict__
+    assert unpickled.entry_hashes[id(unpickled.all_entries[10])] == ehash
+
+
+def test_context(example_api):
+    entry = example_api.all_entries[10]
+    ehash = example_api.hash_entry(entry)
+    context = example_api.context(ehash)
+    assert context['hash'] == ehash
+    assert context['journal'] == [entry]
+    assert context['lineno'] == entry.meta['lineno']
+    assert example_api.context('invalid') is None
+
+
+def test_filter_cache(tmpdir):
+    ledger_file = tmpdir.join('test.beancount')
+    ledger_file.write('2016-01-01 open Assets:Cash\n'
+                      '2017-01-01 open Assets:Bank\n')
+    api = BeancountReportAPI(str(ledger_file))
+
+    view_2016 = api.filter(time='2016')
+    assert len(view_2016.entries) == 1
+    api.filter(time='2017')
+    assert api.filter(time='2016') is view_2016
+    assert view_2016.filters['time'].value == '2016'
+    assert (api.filter_cache_hits, api.filter_cache_misses) == (1, 2)
+
+    api.load_file()
+    view = api.filter(time='2016')
+    assert view is not view_2016
+    assert view.ledger is api.ledger
+    assert api.filter_cache_misses == 3
+
+    api.FILTER_CACHE_SIZE = 1
+    api.filter(time='2017')
+    api.filter(time='2016')
+    assert api.filter_cache_misses == 5
+    assert len(api._filtered) == 1
+
+
+def test_filtered_views(tmpdir):
+    ledger_file = tmpdir.join('test.beancount')
+    ledger_file.write('2016-01-01 open Assets:Cash\n'
+                      '2017-01-01 open Assets:Bank\n')
+    api = BeancountReportAPI(str(ledger_file))
+
+    view_2016 = api.filter(time='2016')
+    view = api.filter()
+    with pytest.raises(FilterException):
+        api.filter(time='not a date')
+    assert len(view_2016.entries) == 1
+    assert view_2016.date_first == datetime.date(2016, 1, 1)
+    assert len(view.entries) == 2
+    assert not view.filters['time']
+
+
+def test_filter_stages(example_api):
+    api = BeancountReportAPI(example_api.beancount_file_path)
+    view_2015 = api.filter(account='Expenses:Food', time='2015')
+    view_2016 = api.filter(account='Expenses:Food', time='2016')
+    assert view_2015.filters['account'] is view_2016.filters['account']
+    assert view_2015.filters['time'] is not view_2016.filters['time']
+    assert len(view_2015.entries) != len(view_2016.entries)
+    assert ('Expenses:Food',) in api._filter_stages
+
+    view = api.filter(account='Expenses:Food', tag='tag1', time='2016')
+    assert view.filters['account'] is view_2016.filters['account']
+    assert view.filters['tag'] is not view_2016.filters['tag']
@@ -1,10 +1,14 @@
-from datetime import date
+from collections import defaultdict
+from datetime import date, timedelta
+import decimal
+import random
 
 from beancount.core.number import D
 import pytest
 
-from fava.api.budgets import (_parse_budget_entry, parse_budgets,
-                              calculate_budget)
+from fava.api.budgets import (_add_repeatedly, _parse_budget_entry,
+                              budget_matrix, parse_budgets, calculate_budget)
+from fava.util.date import interval_tuples, number_of_days_in_period
 
 
 @pytest.fixture
@@ -107,3 +111,105 @@ def test_budgets_doc_yearly(budgets_doc):
 
     assert calculate_budget(budgets_doc, 'Expenses:Books', date(2011, 2, 1),
                             date(2011, 2, 2))['EUR'] == BUDGET / 365
+
+
+def _calculate_budget_daily(budgets, account_name, date_from, date_to):
+    """Add up the daily budgets one by one."""
+    currency_dict = defaultdict(D)
+    for diff in range((date_to - date_from).days):
+        day = date_from + timedelta(diff)
+        matches = {}
+        for budget in budgets[account_name]:
+            if budget.date_start <= day:
+                matches[budget.currency] = budget
+        for budget in matches.values():
+            currency_dict[budget.currency] += \
+                budget.number / number_of_days_in_period(budget.period, day)
+    return dict(currency_dict)
+
+
+def test_budgets_spans(load_doc):
+    """
+    2014-05-01 custom "budget" Expenses:Books "monthly" 100 EUR
+    2014-07-15 custom "budget" Expenses:Books "weekly" 12.50 USD
+    2015-01-01 custom "budget" Expenses:Books "quarterly" 999.99 EUR
+    2015-01-01 custom "budget" Expenses:Books "daily" 3.33 EUR
+    2016-02-10 custom "budget" Expenses:Books "yearly" 99999.87 USD
+    2016-03-01 custom "budget" Expenses:Books "monthly" -45.5 EUR"""
+    entries, _, _ = load_doc
+    budgets, _ = parse_budgets(entries)
+
+    rand = random.Random(1)
+    for _ in range(50):
+        date_from = date(2014, 1, 1) + timedelta(rand.randint(0, 1500))
+        date_to = date_from + timedelta(rand.randint(0, 1500))
+        expected = _calculate_budget_daily(budgets, 'Expenses:Books',
+                                           date_from, date_to)
+        result = calculate_budget(budgets, 'Expenses:Books', date_from,
+                                  date_to)
+        assert list(result) == list(expected)
+        assert [str(number) for number in result.values()] == \
+            [str(number) for number in expected.values()]
+
+
+@pytest.mark.parametrize('interval', ['day', 'week', 'month', 'year'])
+def test_budget_matrix(load_doc, interval):
+    """
+    2014-05-01 custom "budget" Expenses:Books "monthly" 100 EUR
+    2014-07-15 custom "budget" Expenses:Books "weekly" 12.50 USD
+    2015-01-01 custom "budget" Expenses:Books "daily" 3.33 EUR
+    2016-02-10 custom "budget" Expenses:Food "yearly" 99999.87 USD"""
+    entries, _, _ = load_doc
+    budgets, _ = parse_budgets(entries)
+    accounts = ['Expenses', 'Expenses:Books', 'Expenses:Food']
+    intervals = interval_tuples(date(2014, 3, 3), date(2016, 5, 1), interval)
+
+    for accumulate in [False, True]:
+        matrix = budget_matrix(budgets, accounts, intervals, accumulate)
+        assert sorted(matrix) == accounts
+        for account in accounts:
+            expected = [
+                calculate_budget(budgets, account,
+                                 intervals[0][0] if accumulate else begin,
+                                 end)
+                for begin, end in intervals]
+            assert matrix[account] == expected
+            assert [list(budget) for budget in matrix[account]] == \
+                [list(budget) for budget in expected]
+
+    gaps = [intervals[0], intervals[2], intervals[1]]
+    assert budget_matrix(budgets, accounts, gaps)['Expenses:Books'] == [
+        calculate_budget(budgets, 'Expenses:Books', begin, end)
+        for begin, end in gaps]
+    assert budget_matrix(budgets, accounts, []) == \
+        {account: [] for account in accounts}
+
+
+@pytest.mark.parametrize('total,value', [
+    ('0', '7'),
+    ('0', '3.50'),
+    ('1.5', '1E-30'),
+    ('-12.3', '100'),
+    ('123456.78', '-45.5'),
+    ('0', '0.01'),
+])
+def test_add_repeatedly(total, value):
+    for divisor in [1, 3, 7, 29, 31, 91, 365]:
+        value_ = D(value) / divisor
+        for count in [0, 1, 63, 64, 1000, 3653]:
+            expected = D(total)
+            for _ in range(count):
+                expected += value_
+            assert str(_add_repeatedly(D(total), value_, count)) == \
+                str(expected)
+
+
+def test_add_repeatedly_precision():
+    with decimal.localcontext() as context:
+        context.prec = 6
+        total = D(1) / 3
+        value = D(2) / 7
+        expected = total
+        for _ in range(5000):
+            expected += value
+        assert str(_add_repeatedly(total, value, 5000)) == str(expected)
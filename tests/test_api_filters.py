@@ -2,11 +2,12 @@ import datetime
 
 from beancount.core import account
 from beancount.core.data import Transaction
+from beancount.ops import summarize
 import pytest
 
 from fava.api.filters import (
-    FilterException, AccountFilter, FromFilter, PayeeFilter, TagFilter,
-    TimeFilter)
+    FilterException, AccountFilter, EntryIndex, FromFilter, PayeeFilter,
+    TagFilter, TimeFilter)
 
 
 def test_from_filter(example_api):
@@ -25,6 +26,11 @@ def test_from_filter(example_api):
         example_api.all_entries, example_api.options)
     assert len(filtered_entries) == len(example_api.all_entries)
 
+    other_filter = FromFilter()
+    other_filter.set('has_account("Assets:US:ETrade")')
+    filter.set('has_account("Assets:US:ETrade")')
+    assert filter.c_from is other_filter.c_from
+
 
 def test_account_filter(example_api):
     account_filter = AccountFilter()
@@ -43,6 +49,12 @@ def test_account_filter(example_api):
     filtered_entries = account_filter.apply(
         example_api.all_entries, example_api.options)
     assert len(filtered_entries) == 67
+    assert account_filter.matches['Expenses:Taxes:Y2014:US:State']
+    assert not account_filter.matches['Assets:US:BofA:Checking']
+    assert len(account_filter.matches) < 100
+
+    with pytest.raises(FilterException):
+        account_filter.set('Assets:(')
 
 
 def test_time_filter(example_api):
@@ -111,3 +123,36 @@ def test_payee_filter(example_api):
     filtered_entries = payee_filter.apply(
         example_api.all_entries, example_api.options)
     assert len(filtered_entries) == len(example_api.all_entries)
+
+
+@pytest.mark.parametrize('filter_class,value', [
+    (AccountFilter, 'Assets'),
+    (AccountFilter, '.*US:State'),
+    (PayeeFilter, 'asdfasdfasdf, BayBook'),
+    (TagFilter, 'test, ,'),
+    (TagFilter, 'nonexistent'),
+])
+def test_indexed_filters(example_api, filter_class, value):
+    entry_filter = filter_class()
+    entry_filter.set(value)
+    index = EntryIndex(example_api.all_entries)
+    filtered_entries = entry_filter.apply(
+        example_api.all_entries, example_api.options)
+
+    positions = entry_filter.positions(index)
+    assert positions == sorted(positions)
+    assert index.select(positions) == filtered_entries
+
+    assert entry_filter.positions(index, range(100)) == \
+        [position for position in positions if position < 100]
+
+
+@pytest.mark.parametrize('value', ['2014', '2015-03', '2016-06-05', '1000'])
+def test_time_filter_clamp(example_api, value):
+    time_filter = TimeFilter()
+    time_filter.set(value)
+    clamped_entries, _ = summarize.clamp_opt(
+        example_api.all_entries, time_filter.begin_date,
+        time_filter.end_date, example_api.options)
+    assert time_filter.apply(example_api.all_entries,
+                             example_api.options) == clamped_entries
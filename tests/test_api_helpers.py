@@ -1,12 +1,22 @@
 import datetime
 
+from beancount.core import realization
+from beancount.core.interpolate import compute_entries_balance
+from beancount.core.inventory import Inventory
 from beancount.core.position import Cost, Position
 from beancount.core.amount import A
 from beancount.core.number import D
 from beancount.ops.holdings import Holding
 from beancount.ops import prices
+import pytest
 
-from fava.api.helpers import get_holding_from_position, holdings_at_dates
+from fava.api import _real_account
+from fava.api.helpers import (
+    BalanceCheckpoints, cumulative_changes, get_holding_from_position,
+    holdings_at_dates, interval_balances)
+from fava.api.serialization import serialize_inventory
+
+from .conftest import API
 
 
 def test_get_holding_from_position_without_cost():
@@ -49,3 +59,139 @@ def test_holdings_at_dates(load_doc):
     number_of_holdings = list(
         map(len, list(holdings_at_dates(entries, dates, price_map, options))))
     assert number_of_holdings == [0, 1, 2, 3]
+
+
+def _zip_real_accounts(ra_list):
+    """Zip the balances of the realizations, like Fava used to."""
+    first = ra_list[0]
+    return {
+        'account': first.account,
+        'balance_and_balance_children':
+            [(serialize_inventory(ra.balance, at_cost=True),
+              serialize_inventory(realization.compute_balance(ra),
+                                  at_cost=True))
+             for ra in ra_list],
+        'children': [_zip_real_accounts([realization.get(ra, n)
+                                         for ra in ra_list])
+                     for n, a in sorted(first.items())],
+    }
+
+
+@pytest.mark.parametrize('account_name,interval,accumulate,time', [
+    ('Assets', 'month', False, None),
+    ('Assets', 'month', True, None),
+    ('Expenses:Food', 'week', False, '2015'),
+    ('Income', 'year', True, '2015-03 - 2016-07'),
+    ('Equity', 'quarter', True, '2016'),
+    ('Assets:US:BofA:Checking', 'day', False, '2016-05'),
+    ('Assets:NONEXISTENT', 'month', False, None),
+])
+def test_interval_balances(account_name, interval, accumulate, time):
+    view = API.filter(time=time)
+    account_names = [name for name in view.all_accounts
+                     if name.startswith(account_name)]
+    interval_tuples = view._interval_tuples(interval)
+    real_accounts = [
+        _real_account(account_name, view.entries,
+                      interval_tuples[0][0] if accumulate else begin_date,
+                      end_date, min_accounts=account_names)
+        for begin_date, end_date in interval_tuples]
+
+    assert interval_balances(
+        view.entries, view.entry_dates, account_name, account_names,
+        interval_tuples, accumulate) == _zip_real_accounts(real_accounts)
+
+
+@pytest.mark.parametrize('names,interval,time', [
+    (['Income', 'Expenses'], 'month', None),
+    (['Expenses'], 'week', '2015'),
+    (['Assets'], 'year', '2015-03 - 2016-07'),
+    (['Assets:US:ETrade'], 'quarter', None),
+])
+def test_interval_totals(names, interval, time):
+    view = API.filter(time=time)
+    for begin_date, end_date in view._interval_tuples(interval):
+        totals = [realization.compute_balance(
+            _real_account(name, view.entries, begin_date, end_date))
+                  for name in names]
+        assert view._total_balance(names, begin_date, end_date) == \
+            serialize_inventory(sum(totals, Inventory()), at_cost=True)
+
+
+def test_cumulative_changes(load_doc):
+    """
+    2016-01-01 open Assets:Cash
+    2016-01-01 open Assets:Cash:Wallet
+    2016-01-01 open Assets:Stock
+    2016-01-01 open Equity:Opening
+
+    2016-01-01 *
+      Assets:Cash  10 EUR
+      Equity:Opening
+
+    2016-01-01 *
+      Assets:Cash:Wallet  5 EUR
+      Assets:Stock  2 STOCK {3 EUR}
+      Equity:Opening
+
+    2016-01-03 *
+      Assets:Stock  -2 STOCK {3 EUR}
+      Assets:Cash  6 EUR
+    """
+    entries, _, _ = load_doc
+    assert cumulative_changes(entries, 'Assets:Cash') == (
+        [datetime.date(2016, 1, 1), datetime.date(2016, 1, 3)],
+        [{'EUR': D('15')}, {'EUR': D('21')}])
+    assert cumulative_changes(entries, 'Assets') == (
+        [datetime.date(2016, 1, 1), datetime.date(2016, 1, 3)],
+        [{'EUR': D('21')}, {'EUR': D('21')}])
+
+
+CHECKPOINT_DATES = [None, datetime.date(2000, 1, 1), datetime.date(2015, 1, 1),
+                    datetime.date(2015, 7, 16), datetime.date(2030, 1, 1)]
+
+
+@pytest.mark.parametrize('prefix', [
+    '', 'Assets', 'Assets:US:ETrade:GLD', 'Expenses:Food:Restaurant',
+    'Liabilities:US:Chase', 'NONEXISTENT'])
+def test_balance_checkpoints(prefix):
+    view = API.filter()
+    checkpoints = BalanceCheckpoints(view.entries, view.entry_dates)
+    assert checkpoints.memory_usage() > 0
+
+    def predicate(name):
+        return name.startswith(prefix)
+
+    for date in CHECKPOINT_DATES:
+        assert sorted(checkpoints.balance(predicate, date)) == \
+            sorted(compute_entries_balance(view.entries, prefix, date))
+
+    dates = [datetime.date(2014, 1, day) for day in range(1, 32)] + \
+        [datetime.date(2014, 3, 1), datetime.date(2016, 6, 1)]
+    for date, inventory in zip(dates, checkpoints.balances_at_dates(
+            dates, predicate)):
+        assert sorted(inventory) == \
+            sorted(compute_entries_balance(view.entries, prefix, date))
+
+
+@pytest.mark.parametrize('prefix', [
+    '', 'Assets', 'Assets:US:ETrade:GLD', 'Expenses:Food:Restaurant',
+    'Liabilities:US:Chase', 'NONEXISTENT'])
+def test_inventory(prefix):
+    view = API.filter()
+    for date in CHECKPOINT_DATES:
+        assert sorted(view.inventory(prefix, date)) == \
+            sorted(compute_entries_balance(view.entries, prefix, date))
+
+
+@pytest.mark.parametrize('interval', ['year', 'month', 'week'])
+def test_net_worth_at_intervals(interval):
+    view = API.filter(time='2014 - 2015')
+    interval_tuples = view._interval_tuples(interval)
+    dates = [interval_tuples[0][0]] + [p[1] for p in interval_tuples]
+    holdings_list = holdings_at_dates(view.entries, dates, view.price_map,
+                                      view.options)
+    assert view.net_worth_at_intervals(interval) == [{
+        'date': date,
+        'balance': view._holdings_to_net_worth(holdings),
+    } for date, holdings in zip(dates, holdings_list)]
@@ -0,0 +1,178 @@
+import os
+import pickle
+import time
+
+from beancount import loader
+from beancount.utils import encryption
+
+from fava.api import BeancountReportAPI, preload
+from fava.api.loading import (IncrementalLoader, cache_path, load_cache,
+                              remove_cache, write_cache)
+
+
+def _ledger(tmpdir):
+    main = tmpdir.join('main.beancount')
+    main.write('option "title" "Test"\n'
+               'include "accounts.beancount"\n'
+               'include "2016.beancount"\n')
+    tmpdir.join('accounts.beancount').write(
+        '2016-01-01 open Assets:Cash\n'
+        '2016-01-01 open Expenses:Food\n')
+    tmpdir.join('2016.beancount').write(
+        '2016-02-01 * "Lunch"\n'
+        '  Expenses:Food  10.00 EUR\n'
+        '  Assets:Cash\n')
+    return main
+
+
+def _assert_same_as_full_load(result, filename):
+    entries, errors, options_map = result
+    full_entries, full_errors, full_options_map = \
+        loader._load([(filename, True)], None, None, None)
+    assert entries == full_entries
+    assert [error.message for error in errors] == \
+        [error.message for error in full_errors]
+    assert options_map['include'] == full_options_map['include']
+    assert options_map['title'] == full_options_map['title']
+
+
+def test_incremental_loader(tmpdir):
+    main = _ledger(tmpdir)
+    incremental_loader = IncrementalLoader(str(main))
+
+    _assert_same_as_full_load(incremental_loader.load(), str(main))
+    assert incremental_loader.parse_count == 3
+
+    _assert_same_as_full_load(incremental_loader.load(), str(main))
+    assert incremental_loader.parse_count == 3
+
+    tmpdir.join('2016.beancount').write(
+        '2016-02-01 * "Lunch"\n'
+        '  Expenses:Food  12.00 EUR\n'
+        '  Assets:Cash\n'
+        '2016-02-02 * "Dinner"\n'
+        '  Expenses:Food  20.00 EUR\n'
+        '  Assets:Unknown\n')
+    _assert_same_as_full_load(incremental_loader.load(), str(main))
+    assert incremental_loader.parse_count == 4
+
+    main.write('option "title" "Test2"\n'
+               'include "accounts.beancount"\n')
+    _assert_same_as_full_load(incremental_loader.load(), str(main))
+    assert incremental_loader.parse_count == 5
+    assert len(incremental_loader.parsed) == 2
+
+
+def test_incremental_loader_example(example_api):
+    incremental_loader = IncrementalLoader(example_api.beancount_file_path)
+    _assert_same_as_full_load(incremental_loader.load(),
+                              example_api.beancount_file_path)
+
+
+def test_cache(tmpdir):
+    main = _ledger(tmpdir)
+    filename = str(main)
+    assert load_cache(filename) is None
+
+    result = IncrementalLoader(filename).load()
+    write_cache(filename, result)
+    assert os.path.exists(cache_path(filename))
+    _assert_same_as_full_load(load_cache(filename), filename)
+
+    # an up-to-date cache is not written again
+    mtime = os.stat(cache_path(filename)).st_mtime_ns
+    time.sleep(0.01)
+    write_cache(filename, result)
+    assert os.stat(cache_path(filename)).st_mtime_ns == mtime
+
+    tmpdir.join('accounts.beancount').write(
+        '2016-01-01 open Assets:Cash\n')
+    assert load_cache(filename) is None
+
+    tmpdir.join(os.path.basename(cache_path(filename))).write('invalid')
+    assert load_cache(filename) is None
+
+    remove_cache(filename)
+    assert not os.path.exists(cache_path(filename))
+
+
+def test_api_cache(tmpdir):
+    main = _ledger(tmpdir)
+    filename = str(main)
+
+    api = BeancountReportAPI(filename)
+    assert not os.path.exists(cache_path(filename))
+
+    api = BeancountReportAPI(filename, use_cache=True)
+    assert api.loader.parse_count == 3
+    assert os.path.exists(cache_path(filename))
+
+    cached_api = BeancountReportAPI(filename, use_cache=True)
+    assert cached_api.loader.parse_count == 0
+    assert len(cached_api.all_entries) == 3
+
+    # the cache is only read if it is enabled
+    api = BeancountReportAPI(filename)
+    assert api.loader.parse_count == 3
+
+    main.write('option "title" "Test"\n'
+               'include "accounts.beancount"\n')
+    api.load_file()
+    assert api.loader.parse_count == 4
+    assert not os.path.exists(cache_path(filename))
+
+    main.write('2016-01-01 custom "fava-option" "parse-cache" "true"\n'
+               'include "accounts.beancount"\n')
+    api.load_file()
+    assert os.path.exists(cache_path(filename))
+
+
+def test_load_encrypted(tmpdir, monkeypatch):
+    ledger_file = tmpdir.join('test.beancount.gpg')
+    ledger_file.write('2016-01-01 open Assets:Cash\n')
+    decrypted = []
+
+    def read_encrypted_file(filename):
+        decrypted.append(filename)
+        with open(filename) as file:
+            return file.read()
+
+    monkeypatch.setattr(encryption, 'read_encrypted_file',
+                        read_encrypted_file)
+
+    api = BeancountReportAPI(str(ledger_file))
+    assert api.is_encrypted
+    assert len(api.all_entries) == 1
+    assert len(decrypted) == 1
+
+    api.load_file()
+    assert len(decrypted) == 1
+    assert not api.changed()
+
+    # the decrypted result is kept on the loader and shipped with preload
+    preloaded = pickle.loads(pickle.dumps(preload(str(ledger_file))))
+    assert len(decrypted) == 2
+    api = BeancountReportAPI(str(ledger_file), preloaded=preloaded)
+    api.load_file()
+    assert len(decrypted) == 2
+
+    ledger_file.write('2016-01-01 open Assets:Cash\n'
+                      '2016-01-01 open Assets:Bank\n')
+    api.load_file()
+    assert len(decrypted) == 3
+    assert len(api.all_entries) == 2
+    assert not os.path.exists(cache_path(str(ledger_file)))
+
+
+def test_encrypted_changed(tmpdir, monkeypatch):
+    ledger_file = tmpdir.join('test.beancount.gpg')
+    ledger_file.write('2016-01-01 open Assets:Cash\n')
+    monkeypatch.setattr(encryption, 'read_encrypted_file',
+                        lambda filename: open(filename).read())
+
+    api = BeancountReportAPI(str(ledger_file))
+    time.sleep(1)
+    ledger_file.write('2016-01-01 open Assets:Cash\n'
+                      '2016-01-01 open Assets:Bank\n')
+    api.changed()
+    assert api.reload_pending
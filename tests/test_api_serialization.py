@@ -0,0 +1,68 @@
+from beancount.core import realization
+from beancount.core.data import Close, TxnPosting
+from beancount.loader import load_string
+
+from fava.api.serialization import serialize_real_account
+
+
+def _baseline_serialize_inventory(inventory, at_cost=False):
+    if at_cost:
+        inventory = inventory.cost()
+    else:
+        inventory = inventory.units()
+    return {p.units.currency: p.units.number for p in inventory}
+
+
+def baseline_serialize_real_account(real_account):
+    """The serializer that computes the balance of every subtree again."""
+    return {
+        'account': real_account.account,
+        'balance_children':
+            _baseline_serialize_inventory(
+                realization.compute_balance(real_account), at_cost=True),
+        'balance': _baseline_serialize_inventory(real_account.balance,
+                                                 at_cost=True),
+        'is_leaf': len(real_account) == 0 or bool(real_account.txn_postings),
+        'is_closed': isinstance(realization.find_last_active_posting(
+            real_account.txn_postings), Close),
+        'has_transactions': any(isinstance(t, TxnPosting)
+                                for t in real_account.txn_postings),
+        'children': [baseline_serialize_real_account(a)
+                     for n, a in sorted(real_account.items())],
+    }
+
+
+def deep_ledger(depth):
+    """A ledger with a chain of `depth` nested accounts."""
+    lines = ['2016-01-01 open Assets:Cash']
+    name = 'Expenses'
+    for level in range(depth):
+        name += ':Level{}'.format(level)
+        for sibling in ['', ':Other']:
+            lines.append('2016-01-01 open {}{}'.format(name, sibling))
+            lines.append('2016-01-02 * "Payee"\n'
+                         '  {}{}  {}.{} EUR\n'
+                         '  {}{}  1 HOOL {{{} USD}}\n'
+                         '  Assets:Cash'.format(name, sibling, level,
+                                                len(sibling), name, sibling,
+                                                level + 1))
+    return '\n'.join(lines)
+
+
+def test_serialize_real_account(example_api):
+    real_account = example_api.root_account
+    assert serialize_real_account(real_account) == \
+        baseline_serialize_real_account(real_account)
+
+
+def test_serialize_real_account_deep_tree():
+    entries, errors, _ = load_string(deep_ledger(50))
+    assert not errors
+    real_account = realization.realize(entries)
+    serialized = serialize_real_account(real_account)
+    assert serialized == baseline_serialize_real_account(real_account)
+
+    expenses = serialized['children'][1]
+    assert expenses['account'] == 'Expenses'
+    assert expenses['balance'] == {}
+    assert expenses['balance_children']['USD'] == sum(range(1, 51)) * 2
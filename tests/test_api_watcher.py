@@ -1,6 +1,8 @@
 import time
 
-from fava.api.watcher import Watcher
+import pytest
+
+from fava.api.watcher import HAVE_INOTIFY, InotifyWatcher, Watcher
 
 
 def test_watcher_file(tmpdir):
@@ -17,6 +19,7 @@ def test_watcher_file(tmpdir):
     time.sleep(1)
 
     foo.write('test2')
+    watcher.update([str(foo)], [])
 
     assert watcher.check()
 
@@ -35,3 +38,72 @@ def test_watcher_folder(tmpdir):
     foo.mkdir('bar2')
 
     assert watcher.check()
+
+
+@pytest.mark.skipif(not HAVE_INOTIFY, reason='inotify is not available')
+def test_inotify_watcher_file(tmpdir):
+    foo = tmpdir.join('foo')
+    bar = tmpdir.join('bar')
+    foo.write('test')
+    bar.write('test')
+
+    watcher = InotifyWatcher()
+    watcher.update([str(foo)], [])
+    assert not watcher.check()
+
+    bar.write('test2')
+    assert not watcher.check()
+
+    foo.write('test2')
+    assert watcher.check()
+    assert not watcher.check()
+
+    # editors might replace the file on saving
+    bar.rename(foo)
+    assert watcher.check()
+
+    # changes are kept when the watched files are updated
+    foo.write('test3')
+    watcher.update([str(foo)], [])
+    assert watcher.check()
+    assert not watcher.check()
+
+    foo.write('test4')
+    watcher.update([str(foo), str(bar)], [])
+    assert watcher.check()
+    assert not watcher.check()
+
+
+@pytest.mark.skipif(not HAVE_INOTIFY, reason='inotify is not available')
+def test_inotify_watcher_folder(tmpdir):
+    foo = tmpdir.mkdir('foo')
+    bar = foo.mkdir('bar')
+    bar.join('statement.pdf').write('test')
+
+    watcher = InotifyWatcher()
+    watcher.update([], [str(foo)])
+    assert not watcher.check()
+
+    bar.join('statement.pdf').write('test2')
+    assert watcher.check()
+
+    baz = foo.mkdir('bar2').mkdir('baz')
+    assert watcher.check()
+    assert not watcher.check()
+
+    baz.join('statement.pdf').write('test')
+    assert watcher.check()
+
+
+@pytest.mark.skipif(not HAVE_INOTIFY, reason='inotify is not available')
+def test_inotify_watcher_ignores_cache(tmpdir):
+    main = tmpdir.join('main.beancount')
+    main.write('test')
+
+    watcher = InotifyWatcher()
+    watcher.update([str(main)], [str(tmpdir)])
+    tmpdir.join('.main.beancount.favacache').write('cache')
+    assert not watcher.check()
+
+    tmpdir.join('statement.pdf').write('test')
+    assert watcher.check()
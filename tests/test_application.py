@@ -1,8 +1,17 @@
+from collections import OrderedDict
+import threading
+import time
+
 import flask
 import pytest
 import werkzeug.urls
 
-from fava.application import REPORTS
+from fava import application
+from fava.api import BeancountReportAPI
+from fava.application import (REPORTS, _LAST_ACCESS, _LOAD_STATUS, get_api,
+                              load_file, show_loading_page)
+
+from .conftest import EXAMPLE_FILE
 
 
 FILTER_COMBINATIONS = [
@@ -59,7 +68,18 @@ def test_json_api(app, test_client):
 
     result = test_client.get(url)
     data = flask.json.loads(result.get_data(True))
-    assert data == {'changed': False, 'success': True}
+    assert data == {'changed': False, 'pending': False, 'success': True}
+
+
+def test_invalid_filters(app, test_client):
+    with app.test_request_context():
+        app.preprocess_request()
+        url = flask.url_for('report', report_name='journal',
+                            time='notadate', **{'from': 'year =='})
+
+    result = test_client.get(url)
+    assert result.status_code == 200
+    assert 'Failed to parse date: notadate' in result.get_data(True)
 
 
 @pytest.mark.parametrize('referer,jump_link,expect', [
@@ -85,3 +105,183 @@ def test_jump_handler(app, test_client, referer, jump_link, expect):
             expect)
         assert result.status_code == 302
         assert get_url == expect_url
+
+
+def _reset_files(app):
+    """Reset the loaded files and return the previous state."""
+    keys = ['BEANCOUNT_FILES', 'APIS', 'FILE_SLUGS', 'FILE_PATHS',
+            'FILE_TITLES', 'LAZY_LOAD', 'UNLOAD_AFTER', 'MAX_LOADED']
+    state = ({key: app.config[key] for key in keys}, dict(_LOAD_STATUS),
+             dict(_LAST_ACCESS))
+    app.config['APIS'] = {}
+    app.config['FILE_PATHS'] = OrderedDict()
+    app.config['FILE_TITLES'] = {}
+    return state
+
+
+def _restore_files(app, state):
+    """Restore the state returned by `_reset_files`."""
+    config, load_status, last_access = state
+    app.config.update(config)
+    _LOAD_STATUS.clear()
+    _LOAD_STATUS.update(load_status)
+    _LAST_ACCESS.clear()
+    _LAST_ACCESS.update(last_access)
+
+
+def test_load_file_parallel(app, tmpdir):
+    second_file = tmpdir.join('second.beancount')
+    second_file.write('option "title" "Second Ledger"\n')
+    state = _reset_files(app)
+    try:
+        app.config['BEANCOUNT_FILES'] = [EXAMPLE_FILE, str(second_file)]
+        load_file()
+        assert app.config['FILE_SLUGS'] == ['example-beancount-file',
+                                            'second-ledger']
+        for api in app.config['APIS'].values():
+            assert api.load_duration > 0
+    finally:
+        _restore_files(app, state)
+
+
+def test_load_file_single(app, monkeypatch):
+    def no_process_pool():
+        raise AssertionError('no process pool should be started')
+
+    monkeypatch.setattr(application, '_process_context', no_process_pool)
+    state = _reset_files(app)
+    try:
+        app.config['BEANCOUNT_FILES'] = [EXAMPLE_FILE]
+        load_file()
+        assert list(app.config['APIS']) == ['example-beancount-file']
+    finally:
+        _restore_files(app, state)
+
+
+def test_process_context():
+    assert application._process_context().get_start_method() != 'fork'
+
+
+def test_load_file_lazy(app, test_client, tmpdir):
+    filenames = [EXAMPLE_FILE]
+    for name in ['second', 'third', 'fourth']:
+        filename = tmpdir.join(name + '.beancount')
+        filename.write('option "title" "{} Ledger"\n'.format(name))
+        filenames.append(str(filename))
+    state = _reset_files(app)
+    try:
+        app.config['BEANCOUNT_FILES'] = filenames
+        app.config['LAZY_LOAD'] = True
+        app.config['MAX_LOADED'] = 3
+        load_file()
+        assert app.config['FILE_SLUGS'] == [
+            'example-beancount-file', 'second-ledger', 'third-ledger',
+            'fourth-ledger']
+        assert list(app.config['APIS']) == ['example-beancount-file']
+
+        result = test_client.get('/second-ledger/income_statement/')
+        assert result.status_code == 200
+        assert 'third Ledger' in result.get_data(True)
+        assert set(app.config['APIS']) == {'example-beancount-file',
+                                           'second-ledger'}
+
+        test_client.get('/third-ledger/income_statement/')
+        test_client.get('/fourth-ledger/income_statement/')
+        assert set(app.config['APIS']) == {'example-beancount-file',
+                                           'third-ledger', 'fourth-ledger'}
+
+        app.config['UNLOAD_AFTER'] = 1
+        time.sleep(1.1)
+        test_client.get('/example-beancount-file/income_statement/')
+        assert set(app.config['APIS']) == {'example-beancount-file'}
+    finally:
+        _restore_files(app, state)
+
+
+def test_get_api_loads_outside_global_lock(app, tmpdir, monkeypatch):
+    filename = tmpdir.join('second.beancount')
+    filename.write('option "title" "Second Ledger"\n')
+    state = _reset_files(app)
+    loading = threading.Event()
+    release = threading.Event()
+    loads = []
+
+    class SlowAPI(BeancountReportAPI):
+        def __init__(self, *args):
+            loads.append(args[0])
+            loading.set()
+            release.wait(5)
+            super().__init__(*args)
+
+    try:
+        app.config['BEANCOUNT_FILES'] = [EXAMPLE_FILE, str(filename)]
+        app.config['LAZY_LOAD'] = True
+        load_file()
+        monkeypatch.setattr(application, 'BeancountReportAPI', SlowAPI)
+
+        threads = [threading.Thread(target=get_api, args=['second-ledger'])
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        assert loading.wait(5)
+        # other files can be accessed while the second file is loading
+        other = threading.Thread(target=get_api,
+                                 args=['example-beancount-file'])
+        other.start()
+        other.join(2)
+        assert not other.is_alive()
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert loads == [str(filename)]
+        assert 'second-ledger' in app.config['APIS']
+    finally:
+        release.set()
+        _restore_files(app, state)
+
+
+def test_healthz(app, test_client):
+    result = test_client.get('/healthz')
+    assert result.status_code == 200
+    data = flask.json.loads(result.get_data(True))
+    assert data['ready']
+    assert data['loaded'] == data['total'] == 1
+    assert data['duration'] > 0
+
+
+def test_loading_page(app, test_client):
+    _LOAD_STATUS['ready'] = False
+    try:
+        result = test_client.get('/healthz')
+        assert result.status_code == 503
+        assert not flask.json.loads(result.get_data(True))['ready']
+
+        result = test_client.get('/')
+        assert result.status_code == 503
+        assert 'Loading' in result.get_data(True)
+
+        result = test_client.get('/example-beancount-file/journal/')
+        assert result.status_code == 503
+    finally:
+        _LOAD_STATUS['ready'] = True
+
+
+def test_loading_page_finished_during_request(app):
+    with app.test_request_context('/'):
+        # loading was not finished when the file was looked up
+        flask.g.api = None
+        assert _LOAD_STATUS['ready']
+        result = show_loading_page()
+        assert result[1] == 503
+
+
+def test_context(app, test_client):
+    with app.test_request_context():
+        app.preprocess_request()
+        entry = flask.g.api.all_entries[10]
+        url = flask.url_for('context',
+                            ehash=flask.g.ledger.hash_entry(entry))
+
+    result = test_client.get(url)
+    assert result.status_code == 200
+    assert str(entry.meta['lineno']).encode() in result.data
@@ -1,7 +1,7 @@
 from werkzeug.test import Client
 from werkzeug.wrappers import BaseResponse
 
-from fava.util import simple_wsgi, slugify
+from fava.util import cached_property, simple_wsgi, slugify
 
 
 def test_simple_wsgi():
@@ -21,3 +21,20 @@ def test_slugify():
     assert slugify('söße') == 'söße'
     assert slugify('ASDF') == 'asdf'
     assert slugify('ASDF test test') == 'asdf-test-test'
+
+
+def test_cached_property():
+    class Foo(object):
+        calls = 0
+
+        @cached_property
+        def bar(self):
+            """Some docstring."""
+            Foo.calls += 1
+            return Foo.calls
+
+    foo = Foo()
+    assert foo.bar == 1
+    assert foo.bar == 1
+    assert Foo().bar == 2
+    assert Foo.bar.__doc__ == 'Some docstring.'